@@ -0,0 +1,235 @@
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from shapely.geometry import LineString, MultiPolygon, Point, Polygon, box
+
+from src import get_data
+
+# Number of features of each layer of a synthetic city
+CITY_SIZES = {'small': {'edges': 500, 'buildings': 2000, 'parkings': 300, 'parks': 100, 'waterways': 50},
+              'medium': {'edges': 5000, 'buildings': 20000, 'parkings': 3000, 'parks': 1000, 'waterways': 500},
+              'large': {'edges': 20000, 'buildings': 100000, 'parkings': 15000, 'parks': 5000, 'waterways': 2000},
+              }
+CITY_CENTER = (-83.05, 42.33) # lon, lat, near Detroit
+CITY_RADIUS = 0.1 # degrees, ~10 km
+
+def _osm_index(element_types, start=1):
+    """Returns index of (element_type, osmid) pairs, as in features from `ox.geometries_from_place`
+
+    Parameters
+    ----------
+    element_types : list
+        'node', 'way' or 'relation' of every feature
+    start : int
+        first osmid
+    """
+    return pd.MultiIndex.from_arrays([element_types, np.arange(start, start + len(element_types))],
+                                     names=['element_type', 'osmid'])
+
+def make_area(center=CITY_CENTER, radius=CITY_RADIUS, seed=0):
+    """Returns GeoDataFrame with a jagged round shape of a city, as from `ox.geocode_to_gdf`
+
+    Parameters
+    ----------
+    center : tuple
+        (lon, lat) of a city center
+    radius : float
+        mean radius of a city in degrees of latitude
+    seed : int
+        seed of random numbers
+    """
+    rng = np.random.default_rng(seed)
+    angles = np.linspace(0, 2 * np.pi, 200, endpoint=False)
+    radii = radius * (1 + 0.15 * np.sin(5 * angles) + 0.05 * rng.standard_normal(len(angles)))
+    coslat = np.cos(np.deg2rad(center[1]))
+    polygon = Polygon(zip(center[0] + radii * np.cos(angles) / coslat, center[1] + radii * np.sin(angles)))
+
+    return gpd.GeoDataFrame({'display_name': ['Synthetic City'], 'bbox_north': [polygon.bounds[3]],
+                             'bbox_south': [polygon.bounds[1]], 'bbox_east': [polygon.bounds[2]],
+                             'bbox_west': [polygon.bounds[0]]},
+                            geometry=[polygon], crs='EPSG:4326')
+
+def _random_points(area, count, rng):
+    """Returns (count, 2) array of random lon/lat points within the bbox of an area"""
+    minx, miny, maxx, maxy = area.total_bounds
+
+    return np.column_stack([rng.uniform(minx, maxx, count), rng.uniform(miny, maxy, count)])
+
+def _random_boxes(points, size, rng):
+    """Returns boxes of random size around points
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        (count, 2) array of lon/lat
+    size : float
+        mean side of a box in degrees
+    rng : numpy.random.Generator
+        random numbers
+    """
+    sides = rng.uniform(0.3, 1.7, (len(points), 2)) * size
+
+    return [box(x - dx / 2, y - dy / 2, x + dx / 2, y + dy / 2) for (x, y), (dx, dy) in zip(points, sides)]
+
+def _random_lines(points, length, rng, num_vertices=5):
+    """Returns random walks of `num_vertices` vertices starting at points
+
+    Parameters
+    ----------
+    points : numpy.ndarray
+        (count, 2) array of lon/lat
+    length : float
+        mean length of a step in degrees
+    rng : numpy.random.Generator
+        random numbers
+    num_vertices : int
+        number of vertices of a line
+    """
+    steps = rng.normal(0, length, (len(points), num_vertices - 1, 2))
+    walks = points[:, None, :] + np.concatenate([np.zeros((len(points), 1, 2)), np.cumsum(steps, axis=1)], axis=1)
+
+    return [LineString(walk) for walk in walks]
+
+def _mixed_geometries(polygons, points, rng, share_points=0.05, share_multi=0.02):
+    """Turns a share of polygons into points and multipolygons, as OSM features come
+
+        Returns geometries and OSM element types
+
+    Parameters
+    ----------
+    polygons : list
+        shapely polygons
+    points : numpy.ndarray
+        (count, 2) array of lon/lat, centers of polygons
+    rng : numpy.random.Generator
+        random numbers
+    share_points, share_multi : float
+        shares of nodes and multipolygon relations
+    """
+    kinds = rng.choice(['way', 'node', 'relation'], len(polygons),
+                       p=[1 - share_points - share_multi, share_points, share_multi])
+    geometries = []
+    for polygon, (x, y), kind in zip(polygons, points, kinds):
+        if kind == 'node':
+            geometries.append(Point(x, y))
+        elif kind == 'relation':
+            dx = polygon.bounds[2] - polygon.bounds[0]
+            geometries.append(MultiPolygon([polygon, Polygon([(px + 2 * dx, py) for px, py in polygon.exterior.coords])]))
+        else:
+            geometries.append(polygon)
+
+    return geometries, list(kinds)
+
+def make_city(size='small', seed=0):
+    """Returns synthetic city features, same as `get_data.get_many_city_data` does but for water
+
+        Layers have the columns the pipeline relies on: 'highway' and 'bridge' of road edges,
+        'landuse' and 'leisure' of parks; polygons are mixed with points and multipolygons
+
+        Returns area, edges, buildings, parkings, parks, waterways
+
+    Parameters
+    ----------
+    size : str
+        key of `CITY_SIZES`
+    seed : int
+        seed of random numbers
+    """
+    rng = np.random.default_rng(seed)
+    counts = CITY_SIZES[size]
+    area = make_area(seed=seed)
+
+    # road edges, both the ones kept and the ones dropped by `get_data._select_road_edges`
+    points = _random_points(area, counts['edges'], rng)
+    highway = rng.choice(get_data.ROAD_MOTORWAY_TYPES + get_data.ROAD_SECONDARY_TYPES, counts['edges'])
+    bridge = np.where(rng.random(counts['edges']) < 0.05, 'yes', None)
+    edges = gpd.GeoDataFrame({'highway': highway, 'bridge': bridge, 'oneway': rng.random(counts['edges']) < 0.5},
+                             geometry=_random_lines(points, 0.002, rng), crs='EPSG:4326',
+                             index=_osm_index(['way'] * counts['edges']))
+
+    layers = {}
+    for layer, box_size, tags in [('buildings', 0.0002, {'building': 'yes'}),
+                                  ('parkings', 0.0005, {'amenity': 'parking'}),
+                                  ('parks', 0.002, {})]:
+        points = _random_points(area, counts[layer], rng)
+        geometries, kinds = _mixed_geometries(_random_boxes(points, box_size, rng), points, rng)
+        columns = {tag: [value] * len(geometries) for tag, value in tags.items()}
+        if layer == 'parks':
+            is_grass = rng.random(len(geometries)) < 0.3
+            columns = {'landuse': np.where(is_grass, 'grass', None), 'leisure': np.where(is_grass, None, 'park')}
+        columns['name'] = np.where(rng.random(len(geometries)) < 0.2, f'{layer} name', None)
+        layers[layer] = gpd.GeoDataFrame(columns, geometry=geometries, crs='EPSG:4326', index=_osm_index(kinds))
+
+    # waterways are lines (streams) and polygons (lakes), with some nodes
+    count = counts['waterways']
+    points = _random_points(area, count, rng)
+    lines = _random_lines(points, 0.005, rng, num_vertices=20)
+    lakes = _random_boxes(points, 0.004, rng)
+    kinds = rng.choice(['line', 'lake', 'node'], count, p=[0.6, 0.35, 0.05])
+    geometries = [line if kind == 'line' else lake if kind == 'lake' else Point(x, y)
+                  for line, lake, (x, y), kind in zip(lines, lakes, points, kinds)]
+    waterways = gpd.GeoDataFrame({'waterway': np.where(kinds == 'line', 'stream', None),
+                                  'natural': np.where(kinds == 'lake', 'water', None)},
+                                 geometry=geometries, crs='EPSG:4326',
+                                 index=_osm_index(np.where(kinds == 'node', 'node', 'way')))
+
+    return area, edges, layers['buildings'], layers['parkings'], layers['parks'], waterways
+
+def make_water_polygon_file(area, folder, tile_size=0.05):
+    """Writes a small local stand-in for the big water polygons shapefile, returns its path
+
+        Water covers the south-east of the area and beyond, split in square tiles
+        as the pre-calculated Water polygons (https://osmdata.openstreetmap.de/data/water-polygons.html) are
+
+    Parameters
+    ----------
+    area : geopandas.geodataframe.GeoDataFrame
+        GeoDataFrame with shape of a city
+    folder : str
+        folder where to write `water_polygons.shp`
+    tile_size : float
+        side of a water tile in degrees
+    """
+    minx, miny, maxx, maxy = area.total_bounds
+    center_x, center_y = (minx + maxx) / 2, (miny + maxy) / 2
+    # coastline is a diagonal through the city center, water is to the south-east of it
+    xs = np.arange(minx - 2 * (maxx - minx), maxx + 2 * (maxx - minx), tile_size)
+    ys = np.arange(miny - 2 * (maxy - miny), maxy + 2 * (maxy - miny), tile_size)
+    tiles = [box(x, y, x + tile_size, y + tile_size) for x in xs for y in ys
+             if (x - center_x) - (y - center_y) > 0]
+
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, 'water_polygons.shp')
+    gpd.GeoDataFrame({'x': np.arange(len(tiles))}, geometry=tiles, crs='EPSG:4326').to_file(path)
+
+    return path
+
+def make_pictorial_map_images(folder, count=9, size=4000, seed=0):
+    """Writes JPEG images named as saved pictoral maps, `Parks-Parkings {city}.jpg`, returns their paths
+
+    Parameters
+    ----------
+    folder : str
+        folder where to write images
+    count : int
+        number of images
+    size : int
+        side of a square image in pixels
+    seed : int
+        seed of random numbers
+    """
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for indx in range(count):
+        # blocky noise compresses about as well as a map does
+        blocks = rng.integers(0, 256, (size // 40, size // 40, 3), dtype=np.uint8)
+        image = Image.fromarray(blocks).resize((size, size), Image.NEAREST)
+        paths.append(os.path.join(folder, f'Parks-Parkings Synthetic City {indx + 1}, USA.jpg'))
+        image.save(paths[-1], quality=90)
+
+    return paths
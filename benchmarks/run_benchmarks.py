@@ -0,0 +1,259 @@
+"""Offline benchmarks of the pipeline stages on synthetic cities, see `fixtures`
+
+    Run from the root of the repository, f.e.
+        python -m benchmarks.run_benchmarks --sizes small medium
+        python -m benchmarks.run_benchmarks --compare 5731d40
+
+    Every run appends its timings to `benchmarks/results.csv` along with the commit,
+    so that timings of commits made on the same machine can be compared
+"""
+import argparse
+import csv
+import datetime
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from src import custom_visualizations as visuals
+from src import get_data
+from src import metrics
+from src import raster_render
+from src import vector_tiles
+from src import water_store
+from . import fixtures
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), 'results.csv')
+RESULT_FIELDS = ['commit', 'dirty', 'date', 'machine', 'python', 'benchmark', 'size', 'features',
+                 'repeats', 'min_time', 'median_time']
+
+def _git_commit():
+    """Returns short hash of HEAD and whether the tree has uncommitted changes"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True)
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+
+    return commit.stdout.strip(), bool(status.stdout.strip())
+
+def _time(func, repeats, setup=None):
+    """Returns timings of `repeats` calls of a function, in seconds
+
+    Parameters
+    ----------
+    func : callable
+        function to time, with no arguments
+    repeats : int
+        number of calls
+    setup : callable
+        function called (and not timed) before each call
+    """
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+        plt.close('all')
+
+    return timings
+
+def _city_benchmarks(size, folder, dpi):
+    """Returns benchmarks of a synthetic city as list of (name, features, func, setup)
+
+    Parameters
+    ----------
+    size : str
+        key of `fixtures.CITY_SIZES`
+    folder : str
+        temporary folder for files of the fixtures
+    dpi : float
+        pixels per inch of rendered pictoral maps
+    """
+    area, edges, buildings, parkings, parks, waterways = fixtures.make_city(size)
+    water_path = fixtures.make_water_polygon_file(area, os.path.join(folder, 'water'))
+    store_folder = os.path.join(folder, 'water_store')
+    water_store.build_water_store(water_path, store_folder, tile_size=0.1)
+    water = get_data.get_big_water_polygon(area, water_path)
+    layers = (area, edges, buildings, parkings, parks, waterways, water)
+    num_features = sum(len(layer) for layer in layers)
+
+    def _pictorial_map():
+        # same figure as `get_data._render_city`, saved at benchmark dpi
+        fig, ax = plt.subplots(figsize=(16, 16), dpi=dpi)
+        visuals.plot_pictorial_map(*layers, ax)
+        fig.tight_layout()
+        fig.savefig(os.path.join(folder, 'map.jpg'), format='jpg', dpi=dpi)
+
+    return [('filter_road_edges', len(edges), lambda: get_data._select_road_edges(edges), None),
+            ('filter_road_edges_lean', len(edges), lambda: get_data._road_edges_from_features(edges), None),
+            ('big_water_shapefile', len(water), lambda: get_data.get_big_water_polygon(area, water_path), None),
+            ('big_water_store', len(water), lambda: get_data.get_big_water_polygon(area, store_folder), None),
+            ('interim_maps', len(waterways) + len(water), lambda: visuals.plot_interim_maps(area, waterways, water), None),
+            ('pictorial_map', num_features, _pictorial_map, None),
+            ('pictorial_map_raster', num_features,
+             lambda: raster_render.render_pictorial_map(*layers, figsize=16, dpi=dpi), None),
+            ('city_metrics', num_features, lambda: metrics.city_metrics(*layers), None),
+            ('vector_tiles', num_features,
+             lambda: vector_tiles.export_vector_tiles(*layers, os.path.join(folder, 'tiles.mbtiles'), max_zoom=14), None),
+            ]
+
+def _vignette_benchmarks(folder, dpi):
+    """Returns benchmarks of the vignette builder as list of (name, features, func, setup)
+
+        'vignette_cold' makes thumbnails of maps first, 'vignette_warm' reads cached ones
+
+    Parameters
+    ----------
+    folder : str
+        temporary folder for images
+    dpi : float
+        pixels per inch of the vignette
+    """
+    paths = fixtures.make_pictorial_map_images(os.path.join(folder, 'maps'))
+
+    def _build():
+        visuals.build_pictorial_maps_vignette(paths, 0, len(paths), 1, save=False, dpi=dpi)
+
+    def _drop_thumbnails():
+        for path in paths:
+            if os.path.exists(visuals._thumbnail_path(path)):
+                os.remove(visuals._thumbnail_path(path))
+
+    return [('vignette_cold', len(paths), _build, _drop_thumbnails),
+            ('vignette_warm', len(paths), _build, None)]
+
+def _startup_benchmarks():
+    """Returns benchmarks of startup in a fresh interpreter as list of (name, features, func, setup)
+
+        'startup_import' imports the pipeline as a worker process of `get_data._main_parallel` does,
+        'startup_cli_list' runs a cheap command of the command line interface (see `src.__main__`)
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    def _run(*args):
+        subprocess.run([sys.executable, *args], cwd=root, check=True, stdout=subprocess.DEVNULL)
+
+    return [('startup_import', 1, lambda: _run('-c', 'import src.get_data'), None),
+            ('startup_cli_list', 1, lambda: _run('-m', 'src', 'list'), None)]
+
+def run_benchmarks(sizes=('small',), repeats=3, dpi=100, only=None):
+    """Runs benchmarks on synthetic cities, returns list of result dicts
+
+    Parameters
+    ----------
+    sizes : list
+        keys of `fixtures.CITY_SIZES`
+    repeats : int
+        number of timed calls of each benchmark
+    dpi : float
+        pixels per inch of rendered maps, the pipeline itself renders at 1800
+    only : list
+        names of benchmarks to run, all by default
+    """
+    commit, dirty = _git_commit()
+    common = {'commit': commit, 'dirty': dirty, 'date': datetime.datetime.now().isoformat(timespec='seconds'),
+              'machine': platform.node(), 'python': platform.python_version(), 'repeats': repeats}
+
+    results = []
+    folder = tempfile.mkdtemp(prefix='benchmarks_')
+    try:
+        benchmarks = [(size, benchmark) for size in sizes
+                      for benchmark in _city_benchmarks(size, os.path.join(folder, size), dpi)]
+        benchmarks += [('-', benchmark) for benchmark in _vignette_benchmarks(folder, dpi)]
+        benchmarks += [('-', benchmark) for benchmark in _startup_benchmarks()]
+        for size, (name, features, func, setup) in benchmarks:
+            if only and name not in only:
+                continue
+            timings = _time(func, repeats, setup)
+            results.append({**common, 'benchmark': name, 'size': size, 'features': features,
+                            'min_time': min(timings), 'median_time': statistics.median(timings)})
+            print(f"\t {datetime.datetime.now()} {name:<24} {size:<7} {min(timings):9.3f} s")
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    return results
+
+def save_results(results, path=RESULTS_PATH):
+    """Appends results to a CSV file
+
+    Parameters
+    ----------
+    results : list
+        result dicts, as returned by `run_benchmarks`
+    path : str
+        path to a CSV file
+    """
+    is_new = not os.path.exists(path)
+    with open(path, 'a', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=RESULT_FIELDS)
+        if is_new:
+            writer.writeheader()
+        writer.writerows(results)
+
+def load_results(commit, path=RESULTS_PATH):
+    """Returns the latest recorded min time of every (benchmark, size) of a commit
+
+    Parameters
+    ----------
+    commit : str
+        short hash of a commit, as recorded by `run_benchmarks`
+    path : str
+        path to a CSV file
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='') as file:
+        return {(row['benchmark'], row['size']): float(row['min_time'])
+                for row in csv.DictReader(file) if commit.startswith(row['commit']) or row['commit'].startswith(commit)}
+
+def print_comparison(results, baseline, baseline_commit):
+    """Prints timings of a run next to the ones of a baseline commit
+
+    Parameters
+    ----------
+    results : list
+        result dicts, as returned by `run_benchmarks`
+    baseline : dict
+        min times of the baseline, as returned by `load_results`
+    baseline_commit : str
+        short hash of the baseline commit
+    """
+    print(f"{'benchmark':<24} {'size':<7} {baseline_commit:>10} {'current':>10} {'ratio':>7}")
+    for result in results:
+        before = baseline.get((result['benchmark'], result['size']))
+        ratio = f"{result['min_time'] / before:6.2f}x" if before else '-'
+        before = f'{before:9.3f}s' if before else '-'
+        print(f"{result['benchmark']:<24} {result['size']:<7} {before:>10} {result['min_time']:9.3f}s {ratio:>7}")
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Offline benchmarks of the pipeline on synthetic cities')
+    parser.add_argument('--sizes', nargs='+', default=['small'], choices=list(fixtures.CITY_SIZES),
+                        help='sizes of synthetic cities')
+    parser.add_argument('--repeats', type=int, default=3, help='number of timed calls of each benchmark')
+    parser.add_argument('--dpi', type=float, default=100, help='pixels per inch of rendered maps')
+    parser.add_argument('--only', nargs='+', help='names of benchmarks to run')
+    parser.add_argument('--compare', metavar='COMMIT', help='commit to compare timings with')
+    parser.add_argument('--no-save', action='store_true', help=f'do not append results to {RESULTS_PATH}')
+
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = _parse_args()
+    baseline = load_results(args.compare) if args.compare else None
+    results = run_benchmarks(args.sizes, args.repeats, args.dpi, args.only)
+    if not args.no_save:
+        save_results(results)
+    if args.compare:
+        print_comparison(results, baseline, args.compare)
@@ -0,0 +1,146 @@
+"""Command line interface of the pipeline
+
+    Run from the root of the repository, f.e.
+        python -m src list
+        python -m src fetch "Detroit, Michigan, USA" --extent center
+        python -m src render --all --workers 4 --backend raster
+        python -m src vignette
+        python -m src legend
+        python -m src map --get-features
+        python -m src manifest
+
+    Paths of the pipeline are relative to the `src` folder (f.e. '../data'), so commands
+    run there, see `--workdir`. osmnx, geopandas and matplotlib are imported only by
+    the stages which use them, so that `list` and `manifest` return at once
+"""
+import argparse
+import datetime
+import glob
+import os
+
+from . import get_data
+from . import manifest
+from . import vector_tiles
+
+WORKDIR = os.path.dirname(os.path.abspath(__file__))
+
+def _cities(args):
+    """Returns cities selected by command line arguments
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        parsed arguments, see `_parse_args`
+    """
+    if args.all:
+        return get_data.CITIES_LIST
+
+    return get_data._get_list_of_cities(args.cities or None)
+
+def _list(args):
+    cities = manifest.load_manifest()
+    for place in _cities(args):
+        print(f'{place:<45} {manifest.city_status(cities, place)}')
+
+def _manifest(args):
+    cities = manifest.load_manifest()
+    places = args.cities or sorted(cities)
+    print(f"{'place':<45} {'stage':<7} {'status':<7} {'time':<20} details")
+    for place in places:
+        for stage in manifest.STAGES:
+            record = cities.get(place, {}).get(stage)
+            if record is None:
+                continue
+            details = record.get('error') or record.get('output') or ''
+            print(f"{place:<45} {stage:<7} {record['status']:<7} {record['time']:<20} {details}")
+
+def _fetch(args):
+    get_data._main_fetch(_cities(args), slim=args.slim, extent=args.extent, mode=args.mode)
+
+def _render(args):
+    if args.workers > 1:
+        get_data._main_parallel(_cities(args), n_workers=args.workers, max_downloads=args.max_downloads,
+                                max_renders=args.max_renders, backend=args.backend, profiler=args.profiler,
+                                force=args.force, slim=args.slim, extent=args.extent, mode=args.mode)
+    else:
+        get_data._main(_cities(args), get_features=args.get_features, backend=args.backend, profiler=args.profiler,
+                       force=args.force, slim=args.slim, extent=args.extent, mode=args.mode)
+
+def _vignette(args):
+    from . import custom_visualizations as visuals
+
+    paths = args.paths or sorted(glob.glob('Parks-Parkings *.jpg'))
+    for group_num, group_start in enumerate(range(0, len(paths), 9)):
+        print(f'{datetime.datetime.now()} vignette group {group_num}')
+        visuals.build_pictorial_maps_vignette(paths[group_start:group_start + 9], group_start, group_start + 9,
+                                              group_num, dpi=args.dpi)
+
+def _legend(args):
+    from . import custom_visualizations as visuals
+
+    visuals._plot_pictorial_map_legend(args.save_path or '../figures/internal/legend_colors.png')
+
+def _map(args):
+    get_data._main_vector_tiles(_cities(args), get_features=args.get_features, slim=args.slim, extent=args.extent,
+                                mode=args.mode, min_zoom=args.min_zoom, max_zoom=args.max_zoom,
+                                save_path=args.save_path or '../figures/internal/general_map_interactive.html')
+
+def _parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src', description='Parks vs parkings maps of downtowns')
+    parser.add_argument('--workdir', default=WORKDIR, help='folder relative paths of the pipeline start from')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cities = argparse.ArgumentParser(add_help=False)
+    cities.add_argument('cities', nargs='*', help='places in OSM format, a few test cities by default')
+    cities.add_argument('--all', action='store_true', help='all cities of `get_data.CITIES_LIST`')
+    layers = argparse.ArgumentParser(add_help=False)
+    layers.add_argument('--slim', action='store_true', help='keep layers compact')
+    layers.add_argument('--extent', choices=['center', 'density'], help='fetch and plot downtowns only')
+    layers.add_argument('--mode', default=get_data.BATCH_FETCH_MODE,
+                        choices=['auto', 'sequential', 'concurrent', 'combined', 'tiled'],
+                        help='how to query layers, tile by tile for big cities only by default')
+
+    command = commands.add_parser('list', parents=[cities], help='list cities and the last stage each reached')
+    command.set_defaults(func=_list)
+    command = commands.add_parser('manifest', help='print stages recorded in the manifest')
+    command.add_argument('cities', nargs='*', help='places in OSM format, all recorded by default')
+    command.set_defaults(func=_manifest)
+    command = commands.add_parser('fetch', parents=[cities, layers], help='download city features into the cache')
+    command.set_defaults(func=_fetch)
+
+    command = commands.add_parser('render', parents=[cities, layers], help='plot pictorial maps of cities')
+    command.add_argument('--backend', default='matplotlib', choices=['matplotlib', 'raster', 'tiff', 'deepzoom'])
+    command.add_argument('--get-features', action='store_true', help='download features missing in the cache')
+    command.add_argument('--force', action='store_true', help='redo cities which are up to date')
+    command.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], help='profile every stage')
+    command.add_argument('--workers', type=int, default=1, help='number of worker processes, they always download')
+    command.add_argument('--max-downloads', type=int, default=2, help='max cities downloading at once')
+    command.add_argument('--max-renders', type=int, default=1, help='max cities rendering at once')
+    command.set_defaults(func=_render)
+
+    command = commands.add_parser('vignette', help='build vignettes of 9 pictorial maps each')
+    command.add_argument('paths', nargs='*', help='pictorial maps, all in the workdir by default')
+    command.add_argument('--dpi', type=float, default=600, help='pixels per inch of vignettes')
+    command.set_defaults(func=_vignette)
+    command = commands.add_parser('legend', help='plot the legend of colors')
+    command.add_argument('--save-path', help='../figures/internal/legend_colors.png in the workdir by default')
+    command.set_defaults(func=_legend)
+
+    command = commands.add_parser('map', parents=[cities, layers], help='export vector tiles and plot the interactive map')
+    command.add_argument('--get-features', action='store_true', help='download features missing in the cache')
+    command.add_argument('--min-zoom', type=int, default=vector_tiles.MIN_ZOOM)
+    command.add_argument('--max-zoom', type=int, default=vector_tiles.MAX_ZOOM)
+    command.add_argument('--save-path', help='../figures/internal/general_map_interactive.html in the workdir by default')
+    command.set_defaults(func=_map)
+
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    args = _parse_args()
+    # paths given on the command line are relative to where it was run
+    if getattr(args, 'paths', None):
+        args.paths = [os.path.abspath(path) for path in args.paths]
+    if getattr(args, 'save_path', None):
+        args.save_path = os.path.abspath(args.save_path)
+    os.chdir(args.workdir)
+    args.func(args)
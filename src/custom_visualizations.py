@@ -1,14 +1,170 @@
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
-import geopandas as gpd
-import networkx as nx
+import json
+import os
+
+import numpy as np
 # !pip install pywaffle
 # from pywaffle import Waffle
 # import folium
 
+from . import lod
+
+# Colors, alpha and z-order of the pictoral map layers, shared by `plot_pictorial_map` and `raster_render`;
+# layers of one z-order are drawn in the order of this dict. Line widths are in points
+PICTORIAL_MAP_STYLE = {'area': {'color': 'black', 'alpha': 1., 'zorder': 0},
+                       'grass': {'color': 'lightgreen', 'alpha': 0.8, 'zorder': 1},
+                       'water': {'color': 'lightblue', 'alpha': 1., 'zorder': 1}, # #1f77b4
+                       'parks': {'color': 'green', 'alpha': 1., 'zorder': 2},
+                       'waterways': {'color': 'lightblue', 'alpha': 1., 'zorder': 3, 'linewidth': 0.5}, # #1f77b4
+                       'roads': {'color': 'dimgray', 'alpha': 1., 'zorder': 4, 'linewidth': 0.9}, # silver
+                       'buildings': {'color': 'silver', 'alpha': 0.7, 'zorder': 6},
+                       'parkings': {'color': 'yellow', 'alpha': 0.7, 'zorder': 6},
+                       'bridges': {'color': 'dimgray', 'alpha': 0.85, 'zorder': 10, 'linewidth': 0.9}, # silver
+                       }
+PICTORIAL_MAP_BACKGROUND = 'white'
+# Polygons of layers drawn as lines (f.e. lakes among waterways) are filled, web maps get them as separate layers
+AREAS_LAYER_SUFFIX = '_areas'
+
+def _pictorial_map_layers(area, edges, buildings, parkings, parks, waterways, water):
+    """Returns dict of features of each layer of a pictoral map, keys of `PICTORIAL_MAP_STYLE`
+
+        Points are dropped, since they are not shown on a map
+
+    Parameters
+    ----------
+    area, edges, buildings, parkings, parks, waterways, water : geopandas.geodataframe.GeoDataFrame
+        city features, see `plot_pictorial_map`
+    """
+    return {'area': area,
+            'grass': parks[(parks.geom_type != 'Point') & (parks.landuse == 'grass')],
+            'water': water,
+            'parks': parks[(parks.geom_type != 'Point') & (parks.landuse != 'grass')],
+            'waterways': waterways[waterways.geom_type != 'Point'],
+            'roads': edges[edges.bridge.isna()],
+            'buildings': buildings[buildings.geom_type != 'Point'],
+            'parkings': parkings[parkings.geom_type != 'Point'],
+            'bridges': edges[~edges.bridge.isna()]}
+
+def _geometry_paths(geometries):
+    """Returns matplotlib paths of geometries and whether each path is a line
+
+        A polygon is one path with its holes, a line is one open path;
+        parts of multi-geometries are separate paths, points are skipped
+
+    Parameters
+    ----------
+    geometries : iterable
+        shapely geometries
+    """
+    from matplotlib.path import Path
+
+    paths, is_line = [], []
+    for geometry in geometries:
+        for part in getattr(geometry, 'geoms', [geometry]):
+            if part.geom_type == 'Polygon':
+                rings = [np.asarray(ring.coords)[:, :2] for ring in [part.exterior, *part.interiors]]
+                codes = [np.full(len(ring), Path.LINETO, dtype=Path.code_type) for ring in rings]
+                for ring_codes in codes:
+                    ring_codes[0], ring_codes[-1] = Path.MOVETO, Path.CLOSEPOLY
+                paths.append(Path(np.concatenate(rings), np.concatenate(codes)))
+                is_line.append(False)
+            elif part.geom_type in ('LineString', 'LinearRing'):
+                paths.append(Path(np.asarray(part.coords)[:, :2]))
+                is_line.append(True)
+
+    return paths, np.array(is_line, dtype=bool)
+
+def _lod_paths(cache, name, geometries, zoom):
+    """Returns paths of geometries of a layer simplified to a zoom level, see `lod.simplify_for_zoom`
+
+        Paths are made once per layer and zoom level and kept in `cache`,
+        so that panels showing a layer at the same zoom level share them
+
+    Parameters
+    ----------
+    cache : dict
+        paths made so far, {(name, zoom): (paths, is_line)}
+    name : str
+        name of the layer
+    geometries : geopandas.geoseries.GeoSeries
+        geometries of the layer in EPSG:4326
+    zoom : int
+        zoom level
+    """
+    if (name, zoom) not in cache:
+        cache[(name, zoom)] = _geometry_paths(lod.simplify_for_zoom(geometries, zoom))
+
+    return cache[(name, zoom)]
+
+def _plot_paths(ax, paths, is_line, color, alpha=1., zorder=1, linewidth=1.5):
+    """Plots paths of a layer as one PathCollection, polygons filled and lines stroked
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+        axis to plot on
+    paths : list
+        matplotlib paths, see `_geometry_paths`
+    is_line : numpy.ndarray
+        whether each path is a line
+    color : str
+        color of the layer
+    alpha, zorder, linewidth : float
+        style of the layer, linewidth of lines in points
+    """
+    from matplotlib.collections import PathCollection
+    from matplotlib.colors import to_rgba
+
+    if not paths:
+        return
+    rgba, none = np.array(to_rgba(color, alpha)), np.zeros(4)
+    collection = PathCollection(paths, facecolors=np.where(is_line[:, None], none, rgba),
+                                edgecolors=np.where(is_line[:, None], rgba, none),
+                                linewidths=np.where(is_line, linewidth, 0.), zorder=zorder)
+    ax.add_collection(collection, autolim=True)
+
+def _panel_zoom(fig, ax, bounds):
+    """Returns zoom level (see `lod.zoom_for_view`) of a panel of a figure showing `bounds`
+
+    Parameters
+    ----------
+    fig : matplotlib.figure.Figure
+        figure of the panel
+    ax : matplotlib.axes.Axes
+        the panel
+    bounds : tuple
+        (minx, miny, maxx, maxy) shown on the panel, in EPSG:4326
+    """
+    position = ax.get_position()
+
+    return lod.zoom_for_view(bounds, position.width * fig.get_figwidth() * fig.dpi,
+                             position.height * fig.get_figheight() * fig.dpi)
+
+def _set_map_view(ax, bounds=None):
+    """Sets the same scale along both axes of a map in EPSG:4326, and limits it to `bounds` if given
+
+    Parameters
+    ----------
+    ax : matplotlib.axes.Axes
+        axis of the map
+    bounds : tuple
+        (minx, miny, maxx, maxy) in EPSG:4326, data limits of the axis if None
+    """
+    if bounds is None:
+        ax.autoscale_view()
+        miny, maxy = ax.get_ylim()
+    else:
+        minx, miny, maxx, maxy = bounds
+        ax.set_xlim(minx, maxx)
+        ax.set_ylim(miny, maxy)
+    ax.set_aspect(1 / np.cos(np.deg2rad((miny + maxy) / 2)))
+
 def plot_interim_maps(area, waterways, water, place=None, save=False):
     """Plots the far and close looks on a city
 
+        Layers are drawn as one PathCollection each, with geometries simplified
+        to the pixel size of a panel (see `lod`); the close look and the city area
+        panels show the same zoom level and share the paths
+
     Parameters
     ----------
     area : geopandas.geodataframe.GeoDataFrame
@@ -24,6 +180,9 @@ def plot_interim_maps(area, waterways, water, place=None, save=False):
         if save image
     ----------
     """
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Rectangle
+
     # https://matplotlib.org/stable/api/_as_gen/matplotlib.patches.Rectangle.html
     # https://stackoverflow.com/questions/13013781/how-to-draw-a-rectangle-over-a-specific-region-in-a-matplotlib-graph
     # https://wiki.openstreetmap.org/wiki/Tag:natural%3Dcoastline
@@ -33,10 +192,17 @@ def plot_interim_maps(area, waterways, water, place=None, save=False):
     else:
         fig, axes = plt.subplots(1, 2, figsize=(14, 18), dpi=600, facecolor='white')
     axes = axes.flatten()
+    area_bounds = tuple(area.total_bounds)
+    waterways = waterways[waterways.geom_type != 'Point']
+    paths = {}
 
     # Plot 1
     if not water.empty:
-        water.plot(ax=axes[0])
+        minx, miny, maxx, maxy = water.total_bounds
+        far_bounds = (min(minx, area_bounds[0]), min(miny, area_bounds[1]),
+                      max(maxx, area_bounds[2]), max(maxy, area_bounds[3]))
+        zoom = _panel_zoom(fig, axes[0], far_bounds)
+        _plot_paths(axes[0], *_lod_paths(paths, 'water', water.geometry, zoom), color='C0')
         axes[0].add_patch(Rectangle(xy=(area.bounds.minx[0], area.bounds.miny[0]),
                                         width=area.bounds.maxx[0] - area.bounds.minx[0],
                                         height=area.bounds.maxy[0] - area.bounds.miny[0],
@@ -46,25 +212,20 @@ def plot_interim_maps(area, waterways, water, place=None, save=False):
         axes[0].scatter([area.bounds.minx[0], area.bounds.maxx[0]], [area.bounds.miny[0], area.bounds.maxy[0]],
                             s=25, color='red', alpha=0.7)
         axes[0].grid(alpha=0.05, color='grey', linestyle='--', zorder=10)
-
-    # Plot 2
-    # (bN, bS, bE, bW)
-    _ = ox.plot_footprints(gdf=water, bbox=(area.bounds.maxy[0], area.bounds.miny[0], area.bounds.maxx[0], area.bounds.minx[0]), #(bN, bS, bE, bW),
-                           color='lightblue', bgcolor='white',
-                           save=False, show=False, close=False,
-                           ax=axes[-2])
-    waterways[waterways.geom_type != 'Point'].plot(ax=axes[-2], zorder=5, color='lightblue', alpha=0.8)
-    axes[-2].spines[['left', 'right', 'top', 'bottom']].set_visible(True)
+        _set_map_view(axes[0])
+
+    # Plot 2 and 3, close looks at the bbox of the city, at one zoom level
+    zoom = _panel_zoom(fig, axes[-1], area_bounds)
+    for ax, waterways_alpha in [(axes[-2], 0.8), (axes[-1], 1.)]:
+        ax.set_facecolor('white')
+        _plot_paths(ax, *_lod_paths(paths, 'water', water.geometry, zoom), color='lightblue')
+        _plot_paths(ax, *_lod_paths(paths, 'waterways', waterways.geometry, zoom), color='lightblue',
+                    alpha=waterways_alpha, zorder=5)
+        _set_map_view(ax, area_bounds)
+        ax.axis('off') # as `ox.plot_footprints` did
+        ax.spines[['left', 'right', 'top', 'bottom']].set_visible(True)
+    _plot_paths(axes[-1], *_lod_paths(paths, 'area', area.geometry, zoom), color='grey', alpha=0.2, zorder=10)
     axes[-2].set_title('close look', loc='left', family='monospace')
-
-    # Plot 3
-    _ = ox.plot_footprints(gdf=water, bbox=(area.bounds.maxy[0], area.bounds.miny[0], area.bounds.maxx[0], area.bounds.minx[0]), #(bN, bS, bE, bW),
-                           color='lightblue', bgcolor='white',
-                           save=False, show=False, close=False,
-                           ax=axes[-1])
-    waterways[waterways.geom_type != 'Point'].plot(ax=axes[-1], zorder=5, color='lightblue', alpha=1.)
-    area.plot(ax=axes[-1], zorder=10, color='grey', alpha=0.2)
-    axes[-1].spines[['left', 'right', 'top', 'bottom']].set_visible(True)
     axes[-1].set_title('city area', loc='right', family='monospace')
 
     fig.tight_layout()
@@ -98,27 +259,42 @@ def plot_pictorial_map(area, edges, buildings, parkings, parks, waterways, water
     axis : matplotlib.pyplot.axis
         axis object, where to plot
     """
+    layers = _pictorial_map_layers(area, edges, buildings, parkings, parks, waterways, water)
+    style = PICTORIAL_MAP_STYLE
+
     # Plot the footprint
-    area.plot(ax=axis, facecolor='black', zorder=0)
+    layers['area'].plot(ax=axis, facecolor=style['area']['color'], zorder=style['area']['zorder'])
     # Plot street edges
-    edges[edges.bridge.isna()].plot(ax=axis, linewidth=0.9, edgecolor='dimgray', alpha=1., zorder=4) # silver
-    edges[~edges.bridge.isna()].plot(ax=axis, linewidth=0.9, edgecolor='dimgray', alpha=0.85, zorder=10) # silver
+    for layer in ['roads', 'bridges']:
+        layers[layer].plot(ax=axis, linewidth=style[layer]['linewidth'], edgecolor=style[layer]['color'],
+                           alpha=style[layer]['alpha'], zorder=style[layer]['zorder'])
 
     # Plot buildings
-    buildings[buildings.geom_type != 'Point'].plot(ax=axis, facecolor='silver', alpha=0.7, zorder=6)
+    layers['buildings'].plot(ax=axis, facecolor=style['buildings']['color'], alpha=style['buildings']['alpha'],
+                             zorder=style['buildings']['zorder'])
     # Plot parkings
-    parkings[parkings.geom_type != 'Point'].plot(ax=axis, color='yellow', alpha=0.7, markersize=10, zorder=6)
+    layers['parkings'].plot(ax=axis, color=style['parkings']['color'], alpha=style['parkings']['alpha'],
+                            markersize=10, zorder=style['parkings']['zorder'])
     # Plot the parks
-    parks[(parks.geom_type != 'Point') & (parks.landuse != 'grass')].plot(facecolor='green', ax=axis, zorder=2)
-    parks[(parks.geom_type != 'Point') & (parks.landuse == 'grass')].plot(facecolor='lightgreen', ax=axis, alpha=0.8, zorder=1)
+    for layer in ['parks', 'grass']:
+        layers[layer].plot(facecolor=style[layer]['color'], ax=axis, alpha=style[layer]['alpha'], zorder=style[layer]['zorder'])
 
     # DEPRICATED: Plot the general coastline
     # coastline[coastline.geom_type != 'Point'].plot(ax=ax, color='grey', alpha=0.8, lw=0.5, zorder=0)
     # Plot the water and waterways
-    waterways[waterways.geom_type != 'Point'].plot(ax=axis, color='lightblue', edgecolors=None, alpha=1.0, lw=0.5, zorder=3) # #1f77b4
-    ox.plot_footprints(water, bbox=(area.bounds.maxy[0], area.bounds.miny[0], area.bounds.maxx[0], area.bounds.minx[0]), #(bN, bS, bE, bW),
-                       save=False, show=False, close=False,
-                       color='lightblue', bgcolor='white', ax=axis) # #1f77b4
+    layers['waterways'].plot(ax=axis, color=style['waterways']['color'], edgecolors=None, alpha=style['waterways']['alpha'],
+                             lw=style['waterways']['linewidth'], zorder=style['waterways']['zorder'])
+    # as `ox.plot_footprints` did: polygons only, the view of the area without axes
+    water_polygons = layers['water'][layers['water'].geom_type.isin(['Polygon', 'MultiPolygon'])]
+    if not water_polygons.empty:
+        water_polygons.plot(ax=axis, facecolor=style['water']['color'], edgecolor='none', linewidth=0)
+    _set_map_view(axis, tuple(area.total_bounds))
+    axis.margins(0)
+    axis.tick_params(which='both', direction='in')
+    for spine in axis.spines.values():
+        spine.set_visible(False)
+    axis.get_xaxis().set_visible(False)
+    axis.get_yaxis().set_visible(False)
 
     return axis
 
@@ -145,6 +321,8 @@ def plot_pictorial_maps_vignette(path, group_start, group_end, group_num, enumer
     """
     import re
 
+    import matplotlib.pyplot as plt
+
     plt.ioff()
     fig, axes = plt.subplots(3, 3, figsize=(14, 14), dpi=1800, facecolor='white')
     axes = axes.flatten()
@@ -181,6 +359,173 @@ def plot_pictorial_maps_vignette(path, group_start, group_end, group_num, enumer
         print('showing the final vignette')
         plt.show()
 
+THUMBNAIL_SIZE = 2400 # pixels, longest side
+MAX_MAP_PIXELS = 28800 ** 2 # pictoral maps of 16 inches at 1800 dpi, see `get_data.RENDER_DPI`
+
+def _thumbnail_path(image_path):
+    """Returns path of a cached thumbnail of a pictoral map"""
+    return f'{image_path.rsplit(".", 1)[0]}.thumb.png'
+
+def save_pictorial_map_thumbnail(image_path, image=None, size=THUMBNAIL_SIZE):
+    """Saves a downsampled copy of a pictoral map next to it, for `build_pictorial_maps_vignette`
+
+        JPEGs are decoded at a reduced scale right away (`PIL.Image.draft`),
+        so that a full-resolution map is never held in memory
+
+        Returns path of the thumbnail
+
+    Parameters
+    ----------
+    image_path : str
+        path to a pictoral map
+    image : numpy.ndarray
+        the pictoral map itself, if it is still in memory (f.e. after `raster_render`)
+    size : int
+        longest side of the thumbnail in pixels
+    """
+    from PIL import Image
+
+    if image is not None:
+        thumbnail = Image.fromarray(image)
+    else:
+        # 28800x28800 maps are expected, not a decompression bomb; the guard is kept for anything bigger
+        max_pixels = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None if max_pixels is None else max(max_pixels, MAX_MAP_PIXELS)
+        try:
+            thumbnail = Image.open(image_path)
+        finally:
+            Image.MAX_IMAGE_PIXELS = max_pixels
+    thumbnail.draft('RGB', (size, size))
+    thumbnail = thumbnail.convert('RGB')
+    thumbnail.thumbnail((size, size), Image.LANCZOS)
+    thumbnail.save(_thumbnail_path(image_path))
+
+    return _thumbnail_path(image_path)
+
+def _load_thumbnail(image_path, size=THUMBNAIL_SIZE):
+    """Returns a thumbnail of a pictoral map as PIL image, the cached one if it is up to date
+
+    Parameters
+    ----------
+    image_path : str
+        path to a pictoral map
+    size : int
+        longest side of the thumbnail in pixels
+    """
+    from PIL import Image
+
+    thumbnail_path = _thumbnail_path(image_path)
+    if not os.path.exists(thumbnail_path) or os.path.getmtime(thumbnail_path) < os.path.getmtime(image_path):
+        save_pictorial_map_thumbnail(image_path, size=size)
+    thumbnail = Image.open(thumbnail_path).convert('RGB')
+    if max(thumbnail.size) > size:
+        thumbnail.thumbnail((size, size), Image.LANCZOS)
+
+    return thumbnail
+
+def _circled_number(number):
+    """Returns unicode circled number, or 'number.' beyond the ones DejaVu fonts have (1-10)
+
+        # Chart enumeration idea credits to : unicode Circled Numbers
+            http://xahlee.info/comp/unicode_circled_numbers.html
+    """
+    return chr(0x2460 + number - 1) if 1 <= number <= 10 else f'{number}.'
+
+def _load_font(family, size):
+    """Returns PIL font of a DejaVu family ('Sans' or 'Serif'), as matplotlib uses by default
+
+    Parameters
+    ----------
+    family : str
+        'Sans' or 'Serif'
+    size : int
+        font size in pixels
+    """
+    from PIL import ImageFont
+
+    try:
+        return ImageFont.truetype(f'DejaVu{family}.ttf', size)
+    except OSError:
+        pass
+    try:
+        # matplotlib ships DejaVu fonts
+        from matplotlib import font_manager
+        return ImageFont.truetype(font_manager.findfont(f'DejaVu {family}'), size)
+    except (ImportError, OSError):
+        return ImageFont.load_default()
+
+def build_pictorial_maps_vignette(path, group_start, group_end, group_num, enumerate_charts=True, save=True,
+                                  figsize=14, dpi=600, thumbnail_size=THUMBNAIL_SIZE):
+    """Builds a collective chart out of many pictoral maps, the fast alternative to `plot_pictorial_maps_vignette`
+
+        Maps are read as cached thumbnails (see `save_pictorial_map_thumbnail`) and
+        pasted into a 3x3 grid of one RGB array, titles and circled numbers are
+        drawn with PIL; no full-resolution image is decoded and no figure is made
+
+        Returns PIL image of the vignette
+
+    Parameters
+    ----------
+    path : list
+        paths to pictorial maps of current group
+    group_start : int
+        start index of current group of pictorial maps, regarding path
+    group_end : int
+        end index of current group of pictorial maps, regarding path
+    group_num : int
+        index of current group of pictorial maps
+    enumerate_charts : bool
+        if add numbers to a title of pictorial maps in vignette
+    save : bool
+        if save image
+    figsize : float
+        size of the square vignette in inches
+    dpi : float
+        pixels per inch of the saved vignette
+    thumbnail_size : int
+        longest side of map thumbnails in pixels
+    """
+    import re
+    from PIL import Image, ImageDraw
+
+    size = int(round(figsize * dpi))
+    cell = size // 3
+    title_height = cell // 14
+    font = _load_font('Sans', title_height // 2)
+
+    vignette = np.full((size, size, 3), 255, dtype=np.uint8)
+    titles = []
+    for indx, image_path in enumerate(path[:9]):
+        print(f'{indx} \t {image_path}')
+        city = re.search(r'Parks-Parkings (.*)\.(png|jpe?g|tiff?)$', image_path, re.IGNORECASE).group(1)
+
+        thumbnail = _load_thumbnail(image_path, thumbnail_size)
+        scale = min(cell / thumbnail.width, (cell - title_height) / thumbnail.height)
+        thumbnail = np.asarray(thumbnail.resize((max(1, int(thumbnail.width * scale)),
+                                                 max(1, int(thumbnail.height * scale))), Image.LANCZOS))
+
+        top, left = (indx // 3) * cell, (indx % 3) * cell
+        offset_y = top + title_height + (cell - title_height - thumbnail.shape[0]) // 2
+        offset_x = left + (cell - thumbnail.shape[1]) // 2
+        vignette[offset_y:offset_y + thumbnail.shape[0], offset_x:offset_x + thumbnail.shape[1]] = thumbnail
+        titles.append((top, left, re.sub(', USA?$|, United States$', '', city), group_start + indx + 1))
+
+    image = Image.fromarray(vignette)
+    draw = ImageDraw.Draw(image)
+    for top, left, city, number in titles:
+        bbox = draw.textbbox((0, 0), city, font=font)
+        draw.text((left + (cell - (bbox[2] - bbox[0])) // 2, top + title_height // 4), city, fill='black', font=font)
+        if enumerate_charts:
+            draw.text((left + title_height // 4, top + title_height // 4), _circled_number(number),
+                      fill=(128, 128, 128), font=font) # grey, as alpha=0.5 black on white
+
+    if save is True:
+        print('saving the final vignette')
+        save_path_name = f'pictoral_vignette_group_{group_num}'
+        image.save(f'../figures/internal/{save_path_name}.png', format='png', dpi=(dpi, dpi))
+
+    return image
+
 def _plot_pictorial_map_legend(save_path='legend_colors.png'):
     """Plots fancy legend boxes
 
@@ -225,10 +570,75 @@ def _plot_pictorial_map_legend(save_path='legend_colors.png'):
 
     fig.savefig(save_path, format='png', bbox_inches='tight')
 
+VECTOR_GRID_JS = 'https://unpkg.com/leaflet.vectorgrid@1.3.0/dist/Leaflet.VectorGrid.bundled.js'
+
+def _vector_grid_styles():
+    """Returns Leaflet.VectorGrid styles of vector tile layers, as of the pictoral map (`PICTORIAL_MAP_STYLE`)
+
+        Polygons are filled and lines are stroked, as in `_plot_paths`; Leaflet fills open lines too,
+        so polygons of line layers come as layers of their own, see `AREAS_LAYER_SUFFIX`
+    """
+    from matplotlib.colors import to_hex
+
+    styles = {}
+    for layer, style in PICTORIAL_MAP_STYLE.items():
+        color = to_hex(style['color'])
+        areas_style = {'fill': True, 'fillColor': color, 'fillOpacity': style['alpha'], 'stroke': False}
+        if 'linewidth' in style:
+            styles[layer] = {'fill': False, 'stroke': True, 'color': color, 'opacity': style['alpha'],
+                             'weight': style['linewidth']}
+            styles[layer + AREAS_LAYER_SUFFIX] = areas_style
+        else:
+            styles[layer] = areas_style
+
+    return styles
+
+def _add_vector_tiles_overlay(chart, name, tiles_folder, save_path):
+    """Adds a folder of vector tiles of a city (see `vector_tiles.export_vector_tiles`) to a folium map as an overlay
+
+    Parameters
+    ----------
+    chart : folium.Map
+        map to add the overlay to
+    name : str
+        name of the overlay in the layer control
+    tiles_folder : str
+        folder of the tiles
+    save_path : str
+        path where the map is saved, tiles are linked relative to it
+    """
+    import urllib.parse
+
+    import folium
+    from branca.element import Template
+
+    with open(os.path.join(tiles_folder, 'metadata.json')) as file:
+        metadata = json.load(file)
+    minx, miny, maxx, maxy = [float(value) for value in metadata['bounds'].split(',')]
+    folder_url = urllib.parse.quote(os.path.relpath(tiles_folder, os.path.dirname(save_path) or '.').replace(os.sep, '/'))
+
+    # a plain folium Layer, so that the layer control lists it, drawn by Leaflet.VectorGrid
+    overlay = folium.map.Layer(name=name, overlay=True, control=True)
+    overlay._template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.vectorGrid.protobuf(
+                {{ this.url|tojson }},
+                Object.assign({rendererFactory: L.canvas.tile}, {{ this.options|tojson }})
+            ).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+        """)
+    overlay.url = folder_url + '/{z}/{x}/{y}.pbf'
+    overlay.options = {'vectorTileLayerStyles': _vector_grid_styles(), 'minZoom': int(metadata['minzoom']),
+                       'maxNativeZoom': int(metadata['maxzoom']), 'bounds': [[miny, minx], [maxy, maxx]]}
+    overlay.add_to(chart)
+
 def plot_general_map_interactive(data={'Atlanta, Georgia': [33.7489924, -84.3902644]},
-                                save_path='../figures/internal/general_map_interactive.html'):
+                                save_path='../figures/internal/general_map_interactive.html', vector_tiles=None):
     """Plots interactive map of cities locations
 
+        Cities with vector tiles are shown in detail as overlays. Browsers load tiles
+        from files only through a web server, f.e. `python -m http.server` in the root of the repository
+
     Parameters
     ----------
     data : dict
@@ -236,6 +646,9 @@ def plot_general_map_interactive(data={'Atlanta, Georgia': [33.7489924, -84.3902
         Example: {'Atlanta, Georgia': [33.7489924, -84.3902644]}
     save_path
         path where to save an image
+    vector_tiles : dict
+        folders of vector tiles of cities, see `vector_tiles.export_vector_tiles`
+        Example: {'Atlanta, Georgia': '../data/processed/tiles/Atlanta, Georgia'}
     """
     import folium
 
@@ -254,6 +667,11 @@ def plot_general_map_interactive(data={'Atlanta, Georgia': [33.7489924, -84.3902
     for tiles in ['Stamen Terrain', 'Stamen Toner', 'Stamen Water Color', 'cartodbpositron',
                  'cartodbdark_matter']:
         folium.TileLayer(tiles, detect_retina=True).add_to(chart)
+    if vector_tiles:
+        # loaded after Leaflet, which the map puts into the header
+        chart.get_root().html.add_child(folium.Element(f'<script src="{VECTOR_GRID_JS}"></script>'))
+        for key, tiles_folder in vector_tiles.items():
+            _add_vector_tiles_overlay(chart, key, tiles_folder, save_path)
     folium.LayerControl().add_to(chart)
 
     for indx, (key, val) in enumerate(data.items()):
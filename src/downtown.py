@@ -0,0 +1,130 @@
+import datetime
+
+import numpy as np
+
+from . import tiled_fetch
+
+DOWNTOWN_RADIUS = 1500 # meters, of 'center' extent
+DOWNTOWN_SIZE = 3000 # meters, side of 'density' extent
+DENSITY_TAGS = {'building': True}
+METERS_PER_DEGREE = 111320 # of latitude, about
+
+def _meters_to_degrees(meters, lat):
+    """Returns (lon, lat) degrees which `meters` span at latitude `lat`
+
+    Parameters
+    ----------
+    meters : float
+        distance in meters
+    lat : float
+        latitude in degrees
+    """
+    return meters / (METERS_PER_DEGREE * np.cos(np.deg2rad(lat))), meters / METERS_PER_DEGREE
+
+def city_center(area):
+    """Returns (lon, lat) of the center of a city
+
+        Nominatim point of a place (f.e. city hall or main square) if `ox.geocode_to_gdf` gave one,
+        else the centroid of its shape
+
+    Parameters
+    ----------
+    area : geopandas.geodataframe.GeoDataFrame
+        GeoDataFrame with shape of a place, as from `ox.geocode_to_gdf`
+    """
+    if {'lon', 'lat'} <= set(area.columns):
+        return float(area['lon'].iloc[0]), float(area['lat'].iloc[0])
+    centroid = area.geometry.iloc[0].centroid
+
+    return centroid.x, centroid.y
+
+def downtown_from_center(area, radius=DOWNTOWN_RADIUS):
+    """Returns a circle of `radius` meters around the center of a city (see `city_center`), within its shape
+
+    Parameters
+    ----------
+    area : geopandas.geodataframe.GeoDataFrame
+        GeoDataFrame with shape of a place
+    radius : float
+        radius in meters
+    """
+    from shapely import affinity
+    from shapely.geometry import Point
+
+    lon, lat = city_center(area)
+    xfact, yfact = _meters_to_degrees(radius, lat)
+    circle = affinity.scale(Point(lon, lat).buffer(1, resolution=32), xfact=xfact, yfact=yfact)
+
+    return circle.intersection(area.geometry.iloc[0])
+
+def densest_window(area, size=DOWNTOWN_SIZE, tags=DENSITY_TAGS):
+    """Returns a square of `size` meters with the most features with tags within a city, within its shape
+
+        Count-only queries (see `tiled_fetch.estimate_feature_count`) zoom in on the densest part:
+        at each step 3x3 half-size windows, overlapping by half, are counted
+        and the densest one is taken, until a window is `size` meters wide.
+        A city needs about 9 cheap queries per halving of its bbox
+
+    Parameters
+    ----------
+    area : geopandas.geodataframe.GeoDataFrame
+        GeoDataFrame with shape of a place
+    size : float
+        side of the square in meters
+    tags : dict
+        tags of features to count, building footprints by default
+    """
+    from shapely.geometry import box
+
+    polygon = area.geometry.iloc[0]
+    minx, miny, maxx, maxy = polygon.bounds
+    size_x, size_y = _meters_to_degrees(size, (miny + maxy) / 2)
+
+    # with a little tolerance, as a window of exactly `size` may come out a rounding error wider
+    while maxx - minx > size_x * 1.001 or maxy - miny > size_y * 1.001:
+        width, height = max((maxx - minx) / 2, size_x), max((maxy - miny) / 2, size_y)
+        step_x, step_y = (maxx - minx - width) / 2, (maxy - miny - height) / 2
+        windows = [(minx + column * step_x, miny + row * step_y, minx + column * step_x + width, miny + row * step_y + height)
+                   for column in range(3) for row in range(3)]
+        counts = [tiled_fetch.estimate_feature_count(window, tags)
+                  if polygon.intersects(box(*window)) else 0 for window in windows]
+        minx, miny, maxx, maxy = windows[int(np.argmax(counts))]
+        print(f'\t\t {datetime.datetime.now()} densest window {max(counts)} features, '
+              f'{(maxx - minx) / size_x * size / 1000:.1f} km wide')
+
+    return box(minx, miny, maxx, maxy).intersection(polygon)
+
+def downtown_extent(area, method='center', **kwargs):
+    """Returns area of a city reduced to its downtown, so that layers are fetched and plotted within it only
+
+        The returned GeoDataFrame is a copy of `area` with the downtown shape
+        (and its bbox columns, if any), used everywhere in place of the whole city
+
+    Parameters
+    ----------
+    area : geopandas.geodataframe.GeoDataFrame
+        GeoDataFrame with shape of a place, as from `ox.geocode_to_gdf`
+    method : str
+        how to find the downtown
+            * 'center' - circle around the city center, see `downtown_from_center`
+            * 'density' - the densest square of buildings, see `densest_window`
+    **kwargs
+        parameters of the method, f.e. `radius` or `size` in meters
+    """
+    import geopandas as gpd
+
+    if method == 'center':
+        polygon = downtown_from_center(area, **kwargs)
+    elif method == 'density':
+        polygon = densest_window(area, **kwargs)
+    else:
+        raise ValueError(f'unknown downtown method {method!r}')
+
+    downtown = area.copy()
+    downtown[downtown.geometry.name] = gpd.GeoSeries([polygon], index=downtown.index, crs=downtown.crs)
+    minx, miny, maxx, maxy = polygon.bounds
+    for column, value in [('bbox_north', maxy), ('bbox_south', miny), ('bbox_east', maxx), ('bbox_west', minx)]:
+        if column in downtown.columns:
+            downtown[column] = value
+
+    return downtown
@@ -1,15 +1,20 @@
-import logging
-#   https://docs.python.org/3/howto/logging.html
-#   https://docs.python.org/3/howto/logging-cookbook.html#logging-cookbook
 import datetime
+import functools
 import glob
-
-import osmnx as ox
-ox.config(log_console=False, use_cache=True, timeout=10000)
-import geopandas as gpd
-import networkx as nx
+import os
+import time
 
 from . import custom_visualizations as visuals
+from . import downtown
+from . import layer_cache
+from . import manifest
+from . import metrics
+from . import profiling
+from . import raster_render
+from . import tiled_export
+from . import tiled_fetch
+from . import vector_tiles
+from . import water_store
 
 CITIES_LIST = ['Detroit, Michigan, USA', 'Lansing, Michigan, US', 'Grand Rapids, Michigan',
                'Columbus, Ohio, United States', 'Cleveland, Ohio', 'Denver, Colorado',
@@ -21,10 +26,41 @@ CITIES_LIST = ['Detroit, Michigan, USA', 'Lansing, Michigan, US', 'Grand Rapids,
                'Tampa, Florida', 'Baltimore, Maryland', 'St. Louis, Missouri, United States', 'Charlotte, North Carolina', 'San Antonio, Texas',
                'Boston, Massachusetts', 'Los Angeles, California', 'New York City, New York, United States',
                'Chicago, Illinois, United States', 'Berlin, Deutschland', 'Paris, France', 'Bangalore (ಬೆಂಗಳೂರು, Bengaluru)', 'Moscow, Russia']
-BIG_CITIES_BBOXES = {'Los Angeles, California' : [34.15, 33.94, -118.2, -118.28],
-                    'Chicago, Illinois, United States' : [41.925359, 41.821333, -87.582386, -87.686600],
-                    'New York City, New York, United States' : [40.771311, 40.671314, -73.951456, -74.055138],
-                    'Santiago, Chile' : [-33.371278, -33.515664,-70.572588, -70.730517]}
+LAYERS_TAGS = {'buildings': {'building': True},
+               'parkings': {'amenity': 'parking'},
+               'parks': {'leisure': 'park', 'landuse': 'grass'}, # wetland , meadow, golf_course, landuse	recreation_ground
+               'waterways': {'water': True, 'natural' : ['bay', 'strait', 'water'], 'waterway' : True}}
+ROAD_MOTORWAY_TYPES = ['motorway', 'motorway_link']
+ROAD_SECONDARY_TYPES = ['primary', 'primary_link', 'secondary', 'secondary_link', 'tertiary', 'service', 'residential', 'trunk']
+# motorways and bridges of any road, other roads are filtered locally by `_select_road_edges`
+ROAD_EDGES_TAGS = {'highway': ROAD_MOTORWAY_TYPES, 'bridge': True}
+PATH_BIG_WATER_POLYGON_FILE = '../input/water-polygons-big/water-polygons-split-4326/water_polygons.shp'
+# Columns each layer keeps in slim mode (see `_slim_layer`), besides geometry
+SLIM_LAYER_COLUMNS = {'edges': ['highway', 'bridge'], 'buildings': [], 'parkings': [], 'parks': ['landuse'],
+                      'waterways': [], 'water': []}
+# Fetch mode of batch runs (see `get_many_city_data`), 'auto' picks 'tiled' for places
+# with more buildings than one query can take, see `_auto_fetch_mode`
+BATCH_FETCH_MODE = 'auto'
+# Size of rendered pictoral maps, see `_render_city`
+RENDER_FIGSIZE = 16 # inches
+RENDER_DPI = 1800
+
+_OSMNX_CONFIGURED = False
+
+def _osmnx():
+    """Returns osmnx, configured on first use
+
+        osmnx (with networkx, geopandas and matplotlib) takes seconds to import,
+        so it is imported by the stages which query OSM only, not by `import get_data`
+    """
+    import osmnx as ox
+
+    global _OSMNX_CONFIGURED
+    if not _OSMNX_CONFIGURED:
+        ox.config(log_console=False, use_cache=True, timeout=10000)
+        _OSMNX_CONFIGURED = True
+
+    return ox
 
 def _get_list_of_cities(cities=None):
     """Returns a list of test cities
@@ -39,7 +75,19 @@ def _get_list_of_cities(cities=None):
 
     return cities
 
-def get_road_netrowk_graph(place : str):
+def _select_road_edges(edges):
+    """Returns only motorways and bridges of other roads (i.e. see Miami, FL case) out of road edges
+
+    Parameters
+    ----------
+    edges : geopandas.geodataframe.GeoDataFrame
+        road edges with 'highway' and 'bridge' columns
+    """
+    is_motorway = edges['highway'].isin(ROAD_MOTORWAY_TYPES)
+
+    return edges[is_motorway | ((~is_motorway) & (~edges.bridge.isna()))]
+
+def get_road_netrowk_graph(place : str, lean=False, polygon=None):
     """Downloads road network for selected place
         from Open Street Maps via Overpass API using osmnx package
 
@@ -58,18 +106,40 @@ def get_road_netrowk_graph(place : str):
         ### NOTE : No need to do two separate queries for one type of network.
             Easier to get the whole network filtered later
 
+        With `lean=True` only motorway and `bridge=*` ways are requested and the edges
+        are built straight out of them, with no graph construction or simplification.
+        Ways are not merged between intersections then, which makes no difference on a map
+
     Parameters
     ----------
     place : str
         Place (location) name in OSM format to extract geometries from
+    lean : bool
+        if skip building the road network graphs, see above
+    polygon : shapely.geometry.Polygon or MultiPolygon
+        shape to query within instead of the place, f.e. its downtown (see `downtown.downtown_extent`)
     """
+    import networkx as nx
+
+    ox = _osmnx()
+
+    if lean:
+        if polygon is not None:
+            return _road_edges_from_features(ox.geometries_from_polygon(polygon, ROAD_EDGES_TAGS))
+        return _road_edges_from_features(ox.geometries_from_place(place, ROAD_EDGES_TAGS))
+
+    def _graph(custom_filter):
+        if polygon is not None:
+            return ox.graph_from_polygon(polygon, simplify=True, custom_filter=custom_filter)
+        return ox.graph_from_place(place, simplify=True, custom_filter=custom_filter)
+
     # get motorway type-roads, i.e. interstates
-    custom_filter = '["highway"~"motorway|motorway_link"]' #|primary|primary_link|trunk #secondary|secondary_link|ternaty|residential #|trunk
-    graph = ox.graph_from_place(place, simplify=True, custom_filter=custom_filter)
+    custom_filter = f'["highway"~"{"|".join(ROAD_MOTORWAY_TYPES)}"]' #|primary|primary_link|trunk #secondary|secondary_link|tertiary|residential #|trunk
+    graph = _graph(custom_filter)
 
     # get all other car roads
-    custom_filter_2 = '["highway"~"primary|primary_link|secondary|secondary_link|ternaty|service|residential|trunk"]'
-    graph_secondary = ox.graph_from_place(place, simplify=True, custom_filter=custom_filter_2)
+    custom_filter_2 = f'["highway"~"{"|".join(ROAD_SECONDARY_TYPES)}"]'
+    graph_secondary = _graph(custom_filter_2)
 
     graph = nx.compose(graph, graph_secondary)
     del graph_secondary
@@ -78,10 +148,10 @@ def get_road_netrowk_graph(place : str):
     nodes, edges = ox.graph_to_gdfs(graph)
     del graph
 
-    # get only motorways and bridges or secondary roads (i.e. see Miami, FL case)
     print('\t\t selecting highways or bridges only')
-    edges = edges[edges['highway'].isin(['motorway', 'motorway_link']) |
-          ((~edges['highway'].isin(['motorway', 'motorway_link'])) & (~edges.bridge.isna()))]
+    with profiling.stage('filter', place, 'edges') as record:
+        edges = _select_road_edges(edges)
+        record['features'] = len(edges)
 
     return edges
 
@@ -102,24 +172,589 @@ def get_big_water_polygon(area, path_big_water_polygon_file):
         GeoDataFrame with shape of a place to get max and min .bounds from
     path_big_water_polygon_file : str
         path to big water polygon; tested for raw, about ~700Mb, file
+        if a store was built out of it (or it is a store itself), the store is used instead
     """
-    # Load big water polygons
-    path_big_water_polygon_small = '../input/water-polygons/simplified-water-polygons-split-3857/simplified_water_polygons.shp'
-    path_big_water_polygon_large = '../input/water-polygons-big/water-polygons-split-4326/water_polygons.shp'
+    import geopandas as gpd
 
     water_polygon_bbox = (area.bounds.minx[0], area.bounds.miny[0], area.bounds.maxx[0], area.bounds.maxy[0])
 
-    water = gpd.read_file(path_big_water_polygon_large,
-                            bbox=water_polygon_bbox) # Tuple is (minx, miny, maxx, maxy)
-    if water.crs.name != 'WGS 84':
-        water.to_crs(epsg=4326, inplace=True)
-
-    # https://stackoverflow.com/questions/18089667/how-to-estimate-how-much-memory-a-pandas-dataframe-will-need
-    print(f"{water.memory_usage(index=True, deep=True).sum()} bites")
+    store_folder = water_store.find_water_store(path_big_water_polygon_file)
+    if store_folder is not None:
+        # read only tiles of the city from the store, see `water_store.build_water_store`
+        water = water_store.load_water(water_polygon_bbox, store_folder)
+    else:
+        water = gpd.read_file(path_big_water_polygon_file,
+                                bbox=water_polygon_bbox) # Tuple is (minx, miny, maxx, maxy)
+        if water.crs.name != 'WGS 84':
+            water.to_crs(epsg=4326, inplace=True)
 
     return water
 
-def get_many_city_data(place):
+def _load_big_water(place, area, slim=False):
+    """Returns big water polygon of selected area (see `get_big_water_polygon`) as a measured stage
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    area : geopandas.geodataframe.GeoDataFrame
+        GeoDataFrame with shape of a place to get max and min .bounds from
+    slim : bool
+        if keep geometry only, see `_slim_layer`
+    """
+    with profiling.stage('water', place) as record:
+        water = get_big_water_polygon(area, PATH_BIG_WATER_POLYGON_FILE)
+        record['features'] = len(water)
+        # https://stackoverflow.com/questions/18089667/how-to-estimate-how-much-memory-a-pandas-dataframe-will-need
+        record['memory_bytes'] = int(water.memory_usage(index=True, deep=True).sum())
+
+    return _slim_layer(water, 'water', place) if slim else water
+
+def _slim_layer(gdf, layer, place=None):
+    """Returns a compact copy of a fetched layer, as a measured stage
+
+        Only geometry and the columns plotting needs (see `SLIM_LAYER_COLUMNS`)
+        are kept, the tag columns are stored as categoricals; points are dropped
+        out of footprint layers, since no plot shows them
+
+    Parameters
+    ----------
+    gdf : geopandas.geodataframe.GeoDataFrame
+        layer as fetched, with any number of OSM tag columns
+    layer : str
+        name of a layer, key of `SLIM_LAYER_COLUMNS`
+    place : str
+        Place (location) name in OSM format, for the stage record only
+    """
+    keep = SLIM_LAYER_COLUMNS[layer]
+    with profiling.stage('slim', place, layer) as record:
+        record['memory_bytes_before'] = int(gdf.memory_usage(index=True, deep=True).sum())
+        gdf = _ensure_columns(gdf[[column for column in gdf.columns if column in keep] + [gdf.geometry.name]], keep)
+        for column in keep:
+            # merged edges of simplified graphs have lists of tags
+            gdf[column] = gdf[column].map(lambda value: str(value) if isinstance(value, list) else value,
+                                          na_action='ignore').astype('category')
+        if layer in LAYERS_TAGS:
+            gdf = gdf[~gdf.geom_type.isin(['Point', 'MultiPoint'])]
+        record['features'] = len(gdf)
+        record['memory_bytes'] = int(gdf.memory_usage(index=True, deep=True).sum())
+
+    return gdf
+
+def _simplify_layers(layers, place=None, figsize=RENDER_FIGSIZE, dpi=RENDER_DPI):
+    """Returns layers with geometries simplified to the resolution of the pictoral map
+
+        Vertices closer than half a pixel of the map (see `_render_city`) to a simplified
+        shape are removed, which makes no visible difference
+
+    Parameters
+    ----------
+    layers : tuple
+        area, edges, buildings, parkings, parks, waterways, water GeoDataFrames
+    place : str
+        Place (location) name in OSM format, for the stage record only
+    figsize : float
+        size of the square map in inches
+    dpi : float
+        pixels per inch of the map
+    """
+    import numpy as np
+
+    area = layers[0]
+    minx, miny, maxx, maxy = area.total_bounds
+    # one pixel covers the same distance along both axes, see `raster_render._map_transform`
+    coslat = np.cos(np.deg2rad((miny + maxy) / 2))
+    tolerance = max((maxx - minx) * coslat, maxy - miny) / (figsize * dpi) / 2 # degrees of latitude
+
+    simplified = [area]
+    with profiling.stage('simplify', place) as record:
+        for gdf in layers[1:]:
+            gdf = gdf.copy()
+            gdf[gdf.geometry.name] = gdf.geometry.simplify(tolerance)
+            simplified.append(gdf[~gdf.geometry.is_empty])
+        record['features'] = sum(len(gdf) for gdf in simplified[1:])
+
+    return tuple(simplified)
+
+def _fetch_layer(place, layer, polygon=None):
+    """Downloads footprints of one layer (see `LAYERS_TAGS`) for selected place
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format to extract geometries from
+    layer : str
+        name of a layer, key of `LAYERS_TAGS`
+    polygon : shapely.geometry.Polygon or MultiPolygon
+        shape to query within instead of the place, f.e. its downtown (see `downtown.downtown_extent`)
+    """
+    import geopandas as gpd
+
+    ox = _osmnx()
+
+    tags = LAYERS_TAGS[layer]
+    if polygon is not None:
+        if layer == 'waterways':
+            polygon = _buffer_area(gpd.GeoDataFrame(geometry=[polygon], crs='EPSG:4326'), 50)
+        return ox.geometries_from_polygon(polygon, tags)
+    if layer == 'waterways':
+        return ox.geometries_from_place(query=place, tags=tags, buffer_dist=50)
+
+    return ox.geometries_from_place(place, tags)
+
+def _call_with_retries(func, *args, retries=0, **kwargs):
+    """Calls a function, retrying it with exponential backoff if it raises
+
+    Parameters
+    ----------
+    func : callable
+        function to call with *args and **kwargs
+    retries : int
+        how many times to retry a failed call
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func(*args, **kwargs)
+        except Exception as error:
+            if attempt == retries:
+                raise
+            print(f'\t\t {datetime.datetime.now()} {type(error).__name__}: {error}, retrying')
+            time.sleep(2 ** attempt)
+
+def _run_stage(name, place, layer, func, *args, retries=0, slim=False):
+    """Calls a function (with retries) as a measured stage of the pipeline, see `profiling.stage`
+
+        Number of features is recorded for results which have length.
+        With `slim=True` a fetched layer is made compact right away, see `_slim_layer`
+
+    Parameters
+    ----------
+    name : str
+        name of a stage, f.e. 'geocode' or 'fetch'
+    place : str
+        Place (location) name in OSM format
+    layer : str
+        name of a layer, if a stage is about one
+    func : callable
+        function to call with *args
+    retries : int
+        how many times to retry a failed call
+    slim : bool
+        if make a layer compact, see `_slim_layer`
+    """
+    with profiling.stage(name, place, layer) as record:
+        result = _call_with_retries(func, *args, retries=retries)
+        if hasattr(result, '__len__'):
+            record['features'] = len(result)
+
+    if slim and layer in SLIM_LAYER_COLUMNS:
+        result = _slim_layer(result, layer, place)
+
+    return result
+
+def _get_area(place, extent=None, retries=0):
+    """Returns GeoDataFrame with shape of a place, or of its downtown only
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    extent : str
+        None for the whole place, or method of `downtown.downtown_extent` ('center' or 'density')
+    retries : int
+        how many times to retry a failed query
+    """
+    ox = _osmnx()
+
+    area = _run_stage('geocode', place, None, ox.geocode_to_gdf, place, retries=retries)
+    if extent is not None:
+        print(f'\t {datetime.datetime.now()} finding downtown')
+        area = _run_stage('downtown', place, None, downtown.downtown_extent, area, extent, retries=retries)
+
+    return area
+
+def _get_many_city_data_concurrent(place, timeout=None, retries=0, lean_roads=False, slim=False, extent=None,
+                                   max_workers=None):
+    """Downloads many features for selected area, running independent queries together
+        in a pool of threads, see `get_many_city_data`
+
+        A layer which does not finish in `timeout` seconds since its request started is requested again,
+        a stale request is left to finish in the background and its result is dropped.
+        Big water is loaded as soon as the city area is known
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format to extract geometries from
+    timeout : float
+        max seconds to wait for one attempt of a layer, no limit if None
+    retries : int
+        how many times to retry a failed or timed out layer
+    lean_roads : bool
+        if extract road edges without building graphs, see `get_road_netrowk_graph`
+    slim : bool
+        if make layers compact as soon as they arrive, see `_slim_layer`
+    extent : str
+        None for the whole place, or how to find its downtown, see `_get_area`;
+        the downtown is found first, then layers are queried within it
+    max_workers : int
+        number of threads, by default one per layer and one per retry of each layer,
+        so that no request waits behind stale ones; note that Overpass grants few slots per client,
+        osmnx waits for a free slot before each request
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    ox = _osmnx()
+
+    run_stage = functools.partial(_run_stage, slim=slim)
+    results, polygon = {}, None
+    if extent is not None:
+        results['area'] = _get_area(place, extent, retries)
+        polygon = results['area'].geometry.iloc[0]
+        tasks = {'water': (_load_big_water, (place, results['area'], slim))}
+    else:
+        tasks = {'area': (run_stage, ('geocode', place, None, ox.geocode_to_gdf, place))}
+    tasks['edges'] = (run_stage, ('fetch', place, 'edges', get_road_netrowk_graph, place, lean_roads, polygon))
+    tasks.update({layer: (run_stage, ('fetch', place, layer, _fetch_layer, place, layer, polygon)) for layer in LAYERS_TAGS})
+
+    n_tasks = len(tasks) + 1 # big water joins after the area
+    executor = ThreadPoolExecutor(max_workers=max_workers or n_tasks * (retries + 1))
+    futures, attempts, starts = {}, {}, {}
+
+    def _submit(name):
+        func, args = tasks[name]
+        start = [] # filled by the worker, a request waiting for a free thread does not time out
+
+        def _timed_call():
+            start.append(time.monotonic())
+            return func(*args)
+
+        future = executor.submit(_timed_call)
+        futures[future] = name
+        starts[future] = start
+        attempts[name] = attempts.get(name, -1) + 1
+        print(f'\t {datetime.datetime.now()} extracting {name}' + (f', attempt {attempts[name] + 1}' if attempts[name] else ''))
+
+    def _deadline(future):
+        if timeout is None or not starts[future]:
+            return None
+        return starts[future][0] + timeout
+
+    def _retry_or_raise(name, error):
+        if attempts[name] >= retries:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+            raise error
+        print(f'\t\t {datetime.datetime.now()} {name} - {type(error).__name__}: {error}, retrying')
+        _submit(name)
+
+    for name in tasks:
+        _submit(name)
+
+    while futures:
+        if timeout is None:
+            wait_time = None
+        elif all(starts[future] for future in futures):
+            wait_time = max(0, min(_deadline(future) for future in futures) - time.monotonic())
+        else: # check soon when a queued request starts
+            wait_time = min([1.] + [max(0, _deadline(future) - time.monotonic()) for future in futures if starts[future]])
+        done, _ = wait(list(futures), timeout=wait_time, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            name = futures.pop(future)
+            del starts[future]
+            try:
+                results[name] = future.result()
+            except Exception as error:
+                _retry_or_raise(name, error)
+                continue
+            print(f'\t {datetime.datetime.now()} {name} extracted')
+            if name == 'area': # big water needs only the area bounds
+                tasks['water'] = (_load_big_water, (place, results['area'], slim))
+                _submit('water')
+
+        for future in [future for future in futures
+                       if _deadline(future) is not None and _deadline(future) <= time.monotonic()]:
+            name = futures.pop(future)
+            del starts[future]
+            future.cancel() # a running request can not be stopped, it keeps its thread until it returns
+            _retry_or_raise(name, TimeoutError(f'{name} not extracted in {timeout} seconds'))
+
+    executor.shutdown(wait=False)
+
+    return tuple(results[name] for name in ['area', 'edges', 'buildings', 'parkings', 'parks', 'waterways', 'water'])
+
+def _match_tags(gdf, tags):
+    """Returns boolean mask of features which have any of tags, same as osmnx tags semantics
+
+    Parameters
+    ----------
+    gdf : geopandas.geodataframe.GeoDataFrame
+        OSM features with tags as columns
+    tags : dict
+        {tag: True} for any value, {tag: 'value'} or {tag: ['value', ...]} for selected values
+    """
+    import pandas as pd
+
+    mask = pd.Series(False, index=gdf.index)
+    for tag, value in tags.items():
+        if tag not in gdf.columns:
+            continue
+        if value is True:
+            mask |= gdf[tag].notna()
+        elif isinstance(value, str):
+            mask |= gdf[tag] == value
+        else:
+            mask |= gdf[tag].isin(value)
+
+    return mask
+
+def _union_tags(*tags_list):
+    """Returns one tags dict which matches features of any of given tags dicts
+
+    Parameters
+    ----------
+    *tags_list : dict
+        tags in osmnx format, see `_match_tags`
+    """
+    union = {}
+    for tags in tags_list:
+        for tag, value in tags.items():
+            if value is True or union.get(tag) is True:
+                union[tag] = True
+                continue
+            values = [value] if isinstance(value, str) else list(value)
+            union[tag] = union.get(tag, []) + [item for item in values if item not in union.get(tag, [])]
+
+    return union
+
+def _road_edges_from_features(features):
+    """Returns road edges (see `get_road_netrowk_graph`) out of OSM features queried with `ROAD_EDGES_TAGS`
+
+    Parameters
+    ----------
+    features : geopandas.geodataframe.GeoDataFrame
+        OSM features with 'highway' and 'bridge' tags as columns, f.e. railway bridges are dropped
+    """
+    roads = features[_match_tags(features, {'highway': ROAD_MOTORWAY_TYPES + ROAD_SECONDARY_TYPES}) &
+                     features.geom_type.isin(['LineString', 'MultiLineString'])]
+
+    return _drop_empty_columns(_select_road_edges(_ensure_columns(roads, ['bridge'])), ['highway', 'bridge'])
+
+def _buffer_area(area, buffer_dist):
+    """Returns shape of a place buffered by `buffer_dist` meters, same as osmnx does for `buffer_dist`
+
+    Parameters
+    ----------
+    area : geopandas.geodataframe.GeoDataFrame
+        GeoDataFrame with shape of a place
+    buffer_dist : float
+        distance in meters
+    """
+    ox = _osmnx()
+
+    polygon = ox.projection.project_gdf(area)
+    polygon['geometry'] = polygon.geometry.buffer(buffer_dist)
+
+    return ox.projection.project_gdf(polygon, to_latlong=True).geometry.iloc[0]
+
+def _split_combined_layers(features, area):
+    """Splits features of a combined query into road edges and `LAYERS_TAGS` layers
+
+        Returns edges, buildings, parkings, parks, waterways
+
+    Parameters
+    ----------
+    features : geopandas.geodataframe.GeoDataFrame
+        OSM features queried with union of `ROAD_EDGES_TAGS` and `LAYERS_TAGS`
+        over the area buffered by 50 meters
+    area : geopandas.geodataframe.GeoDataFrame
+        GeoDataFrame with shape of a place, all but waterways are kept within it
+    """
+    in_area = features.intersects(area.geometry.iloc[0])
+    edges = _road_edges_from_features(features[in_area])
+
+    layers = {}
+    for layer, tags in LAYERS_TAGS.items():
+        mask = _match_tags(features, tags)
+        if layer != 'waterways':
+            mask &= in_area
+        layers[layer] = features[mask]
+
+    # drop tags of other layers, but keep the ones used in plotting
+    return (_drop_empty_columns(edges, ['highway', 'bridge']),
+            *[_drop_empty_columns(layers[layer], ['landuse'] if layer == 'parks' else []) for layer in LAYERS_TAGS])
+
+def _drop_empty_columns(gdf, keep):
+    """Returns GeoDataFrame without columns which have no values, except geometry and `keep` ones
+
+    Parameters
+    ----------
+    gdf : geopandas.geodataframe.GeoDataFrame
+        any GeoDataFrame
+    keep : list
+        names of columns to keep (or add, if missing) anyway
+    """
+    columns = [column for column in gdf.columns
+               if column == gdf.geometry.name or column in keep or gdf[column].notna().any()]
+
+    return _ensure_columns(gdf[columns], keep)
+
+def _ensure_columns(gdf, columns):
+    """Returns GeoDataFrame with given columns, missing ones are added with empty values
+
+    Parameters
+    ----------
+    gdf : geopandas.geodataframe.GeoDataFrame
+        any GeoDataFrame
+    columns : list
+        names of columns the plotting relies on
+    """
+    import pandas as pd
+
+    gdf = gdf.copy()
+    for column in columns:
+        if column not in gdf.columns:
+            gdf[column] = pd.Series(dtype=object, index=gdf.index)
+
+    return gdf
+
+def _get_many_city_data_combined(place, retries=0, slim=False, extent=None):
+    """Downloads many features for selected area with one combined query, see `get_many_city_data`
+
+        The place polygon is resolved once, all layers are requested with the union of their tags
+        and split locally. The query is cut into tiles by an estimated number of features
+        (see `tiled_fetch.geometries_from_polygon_tiled`), one tile for most cities
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format to extract geometries from
+    retries : int
+        how many times to retry a failed query
+    slim : bool
+        if make layers compact right after splitting, see `_slim_layer`
+    extent : str
+        None for the whole place, or how to find its downtown to query within, see `_get_area`
+    """
+    area = _get_area(place, extent, retries)
+
+    # waterways are queried 50 meters around the place, as in `_fetch_layer`
+    polygon = _buffer_area(area, 50)
+
+    print(f'\t {datetime.datetime.now()} extracting all layers')
+    tags = _union_tags(ROAD_EDGES_TAGS, *LAYERS_TAGS.values())
+    features = _run_stage('fetch', place, 'all', tiled_fetch.geometries_from_polygon_tiled, polygon, tags,
+                          retries=retries)
+    print(f'\t\t num objects: {len(features)}')
+
+    print(f'\t {datetime.datetime.now()} splitting layers')
+    with profiling.stage('filter', place, 'all'):
+        edges, buildings, parkings, parks, waterways = _split_combined_layers(features, area)
+    del features
+    if slim:
+        edges, buildings, parkings, parks, waterways = [
+            _slim_layer(gdf, layer, place) for gdf, layer in zip([edges, buildings, parkings, parks, waterways],
+                                                                 ['edges', *LAYERS_TAGS])]
+
+    print(f'\t {datetime.datetime.now()} extracting big water')
+    water = _load_big_water(place, area, slim)
+
+    return area, edges, buildings, parkings, parks, waterways, water
+
+def _get_many_city_data_tiled(place, retries=0, slim=False, extent=None):
+    """Downloads many features for selected area tile by tile, see `get_many_city_data`
+
+        Each layer is requested over the whole place, cut into tiles by an estimated
+        number of features (see `tiled_fetch.split_into_tiles`), so that one request
+        never gets too big, whatever the size of a city
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format to extract geometries from
+    retries : int
+        how many times to retry a failed layer
+    slim : bool
+        if make layers compact as soon as they arrive, see `_slim_layer`
+    extent : str
+        None for the whole place, or how to find its downtown to query within, see `_get_area`
+    """
+    area = _get_area(place, extent, retries)
+    polygon = area.geometry.iloc[0]
+
+    print(f'\t {datetime.datetime.now()} extracting roads')
+    edges = _run_stage('fetch', place, 'edges', tiled_fetch.geometries_from_polygon_tiled,
+                       polygon, ROAD_EDGES_TAGS, retries=retries, slim=slim)
+    with profiling.stage('filter', place, 'edges'):
+        edges = _road_edges_from_features(edges)
+
+    layers = {}
+    for layer, tags in LAYERS_TAGS.items():
+        print(f'\t {datetime.datetime.now()} extracting {layer}')
+        # waterways are queried 50 meters around the place, as in `_fetch_layer`
+        layer_polygon = _buffer_area(area, 50) if layer == 'waterways' else polygon
+        layers[layer] = _run_stage('fetch', place, layer, tiled_fetch.geometries_from_polygon_tiled,
+                                   layer_polygon, tags, retries=retries, slim=slim)
+        print(f'\t\t num objects: {len(layers[layer])}')
+    layers['parks'] = _ensure_columns(layers['parks'], ['landuse'])
+
+    print(f'\t {datetime.datetime.now()} extracting big water')
+    water = _load_big_water(place, area, slim)
+
+    return (area, edges, *layers.values(), water)
+
+def _layers_cache_key(place, mode, lean_roads=False, slim=False, extent=None):
+    """Returns key of processed layers of a place in `layer_cache`
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    mode : str
+        fetch mode, see `get_many_city_data`
+    lean_roads : bool
+        if road edges are extracted without graphs, see `get_road_netrowk_graph`
+    slim : bool
+        if layers are compact, see `get_many_city_data`
+    extent : str
+        how the downtown was found, if layers are of a downtown only
+    """
+    tags = {'roads': ROAD_EDGES_TAGS, 'road_types': ROAD_MOTORWAY_TYPES + ROAD_SECONDARY_TYPES, **LAYERS_TAGS}
+
+    return layer_cache.cache_key(place, tags, mode=mode,
+                                 lean_roads=lean_roads and mode in ['sequential', 'concurrent'],
+                                 water=PATH_BIG_WATER_POLYGON_FILE,
+                                 slim=[RENDER_FIGSIZE, RENDER_DPI, SLIM_LAYER_COLUMNS] if slim else False,
+                                 **({'extent': [extent, downtown.DOWNTOWN_RADIUS, downtown.DOWNTOWN_SIZE]} if extent else {}))
+
+def load_cached_city_data(place, mode='sequential', lean_roads=False, slim=False, extent=None):
+    """Loads features of selected area saved by `get_many_city_data(..., use_cache=True)`
+
+        Returns the same 7-tuple as `get_many_city_data`, without any network requests
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    mode : str
+        fetch mode the features were downloaded with
+    lean_roads : bool
+        if road edges were extracted without graphs
+    slim : bool
+        if layers were made compact
+    extent : str
+        how the downtown was found, if layers are of a downtown only
+    """
+    layers = layer_cache.load_layers(_layers_cache_key(place, mode, lean_roads, slim, extent))
+    if layers is None:
+        raise FileNotFoundError(f'no cached layers of {place!r}, run with get_features=True first')
+
+    return layers
+
+def get_many_city_data(place, mode='sequential', timeout=None, retries=0, lean_roads=False, use_cache=False,
+                       slim=False, extent=None):
     """Downloads many features for selected area
         from Open Street Maps via Overpass API using osmnx package
 
@@ -144,66 +779,671 @@ def get_many_city_data(place):
     ----------
     place : str
         Place (location) name in OSM format to extract geometries from
+    mode : str
+        how to query layers
+            * 'sequential' - one after another
+            * 'concurrent' - independent layers together, see `_get_many_city_data_concurrent`
+            * 'combined' - all layers with one query, see `_get_many_city_data_combined`
+            * 'tiled' - each layer tile by tile, see `_get_many_city_data_tiled`
+            * 'auto' - 'tiled' for big places, else 'sequential', see `_auto_fetch_mode`
+    timeout : float
+        max seconds to wait for one attempt of a layer, 'concurrent' mode only
+    retries : int
+        how many times to retry a failed layer
+    lean_roads : bool
+        if extract road edges without building graphs, see `get_road_netrowk_graph`;
+        'combined' and 'tiled' modes never build graphs
+    use_cache : bool
+        if load processed layers from `layer_cache` or download and save them there
+    slim : bool
+        if keep layers compact: each one is pruned to the columns plotting needs,
+        with categorical tags and no points, as soon as it is fetched (see `_slim_layer`),
+        then geometries are simplified to the resolution of the map (see `_simplify_layers`)
+    extent : str
+        None for the whole place, or how to find its downtown (see `downtown.downtown_extent`):
+            * 'center' - a circle around the city center
+            * 'density' - the densest square of buildings, found with count-only queries
+        then all layers are queried within the downtown and the returned area is the downtown,
+        so that maps are plotted within it too
     """
+    if use_cache:
+        key = _layers_cache_key(place, mode, lean_roads, slim, extent)
+        with profiling.stage('cache_load', place):
+            layers = layer_cache.load_layers(key)
+        if layers is not None:
+            print(f'{datetime.datetime.now()} location - {place}, loaded from cache')
+            return layers
+        layers = get_many_city_data(place, mode=mode, timeout=timeout, retries=retries, lean_roads=lean_roads,
+                                    slim=slim, extent=extent)
+        with profiling.stage('cache_save', place):
+            layer_cache.save_layers(key, layers, place)
+        return layers
 
     print(f'{datetime.datetime.now()} location - {place}')
-    area = ox.geocode_to_gdf(place)
+    if mode == 'auto':
+        mode = _auto_fetch_mode(place, extent, retries)
+    if mode == 'sequential':
+        layers = _get_many_city_data_sequential(place, retries=retries, lean_roads=lean_roads, slim=slim, extent=extent)
+    elif mode == 'concurrent':
+        layers = _get_many_city_data_concurrent(place, timeout=timeout, retries=retries, lean_roads=lean_roads,
+                                                slim=slim, extent=extent)
+    elif mode == 'combined':
+        layers = _get_many_city_data_combined(place, retries=retries, slim=slim, extent=extent)
+    elif mode == 'tiled':
+        layers = _get_many_city_data_tiled(place, retries=retries, slim=slim, extent=extent)
+    else:
+        raise ValueError(f'unknown mode {mode!r}')
+
+    if extent is not None:
+        layers = _clip_layers(layers, place)
+    if slim:
+        layers = _simplify_layers(layers, place)
+
+    return layers
+
+def _auto_fetch_mode(place, extent=None, retries=0):
+    """Returns 'tiled' fetch mode for a place with more buildings than one query can take, else 'sequential'
+
+        Buildings are the biggest layer, they are counted over the bbox of the place
+        with a cheap count-only query (see `tiled_fetch.estimate_feature_count`);
+        a downtown is small enough anyway
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    extent : str
+        None for the whole place, or how to find its downtown, see `get_many_city_data`
+    retries : int
+        how many times to retry a failed query
+    """
+    if extent is not None:
+        return 'sequential'
+
+    area = _get_area(place, None, retries)
+    count = _run_stage('estimate', place, 'buildings', tiled_fetch.estimate_feature_count, tuple(area.total_bounds),
+                       LAYERS_TAGS['buildings'], retries=retries)
+    mode = 'tiled' if count > tiled_fetch.MAX_FEATURES_PER_TILE else 'sequential'
+    print(f'\t {datetime.datetime.now()} ~{count} buildings, {mode} mode')
+
+    return mode
+
+def _clip_layers(layers, place=None):
+    """Returns layers clipped to the shape of the area, f.e. to a downtown (see `downtown.downtown_extent`)
+
+        Features crossing the border (long roads, waterways, big water) are cut,
+        so that nothing is drawn around a downtown
+
+    Parameters
+    ----------
+    layers : tuple
+        area, edges, buildings, parkings, parks, waterways, water GeoDataFrames
+    place : str
+        Place (location) name in OSM format, for the stage record only
+    """
+    import geopandas as gpd
+
+    area = layers[0]
+    with profiling.stage('clip', place) as record:
+        clipped = [area] + [gpd.clip(gdf, area) if not gdf.empty else gdf for gdf in layers[1:]]
+        record['features'] = sum(len(gdf) for gdf in clipped[1:])
+
+    return tuple(clipped)
+
+def _get_many_city_data_sequential(place, retries=0, lean_roads=False, slim=False, extent=None):
+    """Downloads many features for selected area one layer after another, see `get_many_city_data`
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format to extract geometries from
+    retries : int
+        how many times to retry a failed layer
+    lean_roads : bool
+        if extract road edges without building graphs, see `get_road_netrowk_graph`
+    slim : bool
+        if make layers compact as soon as they arrive, see `_slim_layer`
+    extent : str
+        None for the whole place, or how to find its downtown to query within, see `_get_area`
+    """
+    area = _get_area(place, extent, retries)
+    polygon = area.geometry.iloc[0] if extent is not None else None
     bN, bS, bE, bW = area.bounds.maxy[0], area.bounds.miny[0], area.bounds.maxx[0], area.bounds.minx[0]
 
     print(f'\t {datetime.datetime.now()} extracting roads')
-    edges = get_road_netrowk_graph(place)
+    edges = _run_stage('fetch', place, 'edges', get_road_netrowk_graph, place, lean_roads, polygon,
+                       retries=retries, slim=slim)
 
     print(f'\t {datetime.datetime.now()} extracting buildings')
-    tags = {'building': True}
-    if place not in BIG_CITIES_BBOXES:
-        buildings = ox.geometries_from_place(place, tags)
-    else:
-        buildings = ox.geometries_from_bbox(*BIG_CITIES_BBOXES[place], tags)
+    buildings = _run_stage('fetch', place, 'buildings', _fetch_layer, place, 'buildings', polygon,
+                           retries=retries, slim=slim)
     #     print(f'\t\t num objects: {len(buildings)}')
 
     print(f'\t {datetime.datetime.now()} extracting parkings')
-    tags = {'amenity': 'parking'}
-    parkings = ox.geometries_from_place(place, tags)
+    parkings = _run_stage('fetch', place, 'parkings', _fetch_layer, place, 'parkings', polygon,
+                          retries=retries, slim=slim)
     print(f'\t\t num objects: {len(parkings)}')
 
     print(f'\t {datetime.datetime.now()} extracting parks')
-    tags = {'leisure': 'park', 'landuse': 'grass'} # wetland , meadow, golf_course, landuse	recreation_ground
-    parks = ox.geometries_from_place(place, tags)
+    parks = _run_stage('fetch', place, 'parks', _fetch_layer, place, 'parks', polygon,
+                       retries=retries, slim=slim)
     print(f'\t\t num objects: {len(parks)}')
 
     print(f'\t {datetime.datetime.now()} extracting waterways')
-    tags = {'water': True, 'natural' : ['bay', 'strait', 'water'], 'waterway' : True}
-    waterways = ox.geometries_from_place(query=place, tags=tags, buffer_dist=50)
+    waterways = _run_stage('fetch', place, 'waterways', _fetch_layer, place, 'waterways', polygon,
+                           retries=retries, slim=slim)
 
     print(f'\t {datetime.datetime.now()} extracting big water')
-    path_big_water_polygon_file = '../input/water-polygons-big/water-polygons-split-4326/water_polygons.shp'
-    water = get_big_water_polygon(area, path_big_water_polygon_file)
+    water = _load_big_water(place, area, slim)
 
     return area, edges, buildings, parkings, parks, waterways, water
 
-def _main(cities=_get_list_of_cities(None), get_features=False):
+def _render_output_path(place, backend='matplotlib'):
+    """Returns path of the pictoral map of a city saved by `_render_city`
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    backend : str
+        how the pictoral map is rendered, see `_render_city`
+    """
+    extensions = {'matplotlib': 'jpg', 'raster': 'jpg', 'tiff': 'tif', 'deepzoom': 'dzi'}
+    if backend not in extensions:
+        raise ValueError(f'unknown backend {backend!r}')
+
+    return f"Parks-Parkings {place}.{extensions[backend]}"
+
+def _render_hash(backend='matplotlib'):
+    """Returns a hash of everything but the layers a pictoral map depends on: style, size, backend and code version
+
+    Parameters
+    ----------
+    backend : str
+        how the pictoral map is rendered, see `_render_city`
+    """
+    from . import __version__
+
+    return manifest.content_hash(visuals.PICTORIAL_MAP_STYLE, visuals.PICTORIAL_MAP_BACKGROUND,
+                                 backend, RENDER_FIGSIZE, RENDER_DPI, __version__)
+
+def _render_city(place, area, edges, buildings, parkings, parks, waterways, water, backend='matplotlib'):
+    """Plots interim cartograms and the pictoral map of a city, saves the map to disk
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format, used in the name of a saved image
+    area, edges, buildings, parkings, parks, waterways, water : geopandas.geodataframe.GeoDataFrame
+        city features, as returned by `get_many_city_data`
+    backend : str
+        how to render the pictoral map
+            * 'matplotlib' - with `custom_visualizations.plot_pictorial_map`
+            * 'raster' - straight into a pixel buffer, see `raster_render.render_pictorial_map`
+            * 'tiff' - streamed into a tiled TIFF, see `tiled_export.export_tiled_tiff`
+            * 'deepzoom' - streamed into a zoomable tile pyramid, see `tiled_export.export_deepzoom`
+    """
+    import matplotlib.pyplot as plt
+
+    print(f'\t {datetime.datetime.now()} plotting interim cartograms')
+    with profiling.stage('interim_plots', place):
+        visuals.plot_interim_maps(area, waterways, water, place, False)
+        plt.close('all')
+
+    print(f'\t {datetime.datetime.now()} plotting chart')
+    if backend == 'raster':
+        with profiling.stage('render', place, backend):
+            image = raster_render.render_pictorial_map(area, edges, buildings, parkings, parks, waterways, water,
+                                                       save_path=_render_output_path(place, backend),
+                                                       figsize=RENDER_FIGSIZE, dpi=RENDER_DPI)
+        # thumbnail for vignettes, see `visuals.build_pictorial_maps_vignette`
+        with profiling.stage('thumbnail', place):
+            visuals.save_pictorial_map_thumbnail(_render_output_path(place, backend), image=image)
+        return
+    elif backend == 'tiff':
+        with profiling.stage('render', place, backend):
+            tiled_export.export_tiled_tiff(area, edges, buildings, parkings, parks, waterways, water,
+                                           save_path=_render_output_path(place, backend),
+                                           figsize=RENDER_FIGSIZE, dpi=RENDER_DPI)
+        return
+    elif backend == 'deepzoom':
+        with profiling.stage('render', place, backend):
+            tiled_export.export_deepzoom(area, edges, buildings, parkings, parks, waterways, water,
+                                         save_path=_render_output_path(place, backend)[:-len('.dzi')],
+                                         figsize=RENDER_FIGSIZE, dpi=RENDER_DPI)
+        return
+    elif backend != 'matplotlib':
+        raise ValueError(f'unknown backend {backend!r}')
+
+    # Create a subplot object for plotting the layers onto a common map
+    with profiling.stage('render', place, backend):
+        fig, ax = plt.subplots(figsize=(RENDER_FIGSIZE, RENDER_FIGSIZE), dpi=400) # dpi=600
+        visuals.plot_pictorial_map(area, edges, buildings, parkings, parks, waterways, water, ax)
+        fig.tight_layout()
+    print(f'\t {datetime.datetime.now()} saving chart')
+    with profiling.stage('save', place, backend):
+        # fig.savefig(f"Parks-Parkings {place}.svg", format = 'svg', dpi=1800)
+        fig.savefig(_render_output_path(place, backend), format = 'jpg', dpi=RENDER_DPI)
+        plt.close('all')
+    # thumbnail for vignettes, see `visuals.build_pictorial_maps_vignette`
+    with profiling.stage('thumbnail', place):
+        visuals.save_pictorial_map_thumbnail(_render_output_path(place, backend))
+
+def _is_city_up_to_date(place, backend='matplotlib', slim=False, extent=None, mode=BATCH_FETCH_MODE):
+    """Returns if the pictoral map of a city is saved and made of the same layers and style as now, see `manifest`
+
+        No layers are loaded, only the manifest is read
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    backend : str
+        how the pictoral map is rendered, see `_render_city`
+    slim : bool
+        if layers are compact, see `get_many_city_data`
+    extent : str
+        how the downtown is found, if maps are of a downtown only, see `get_many_city_data`
+    mode : str
+        fetch mode, see `get_many_city_data`
+    """
+    cities = manifest.load_manifest()
+    fetched = manifest.get_stage(cities, place, 'fetch', key=_layers_cache_key(place, mode, slim=slim, extent=extent))
+    if fetched is None:
+        return False
+    rendered = manifest.get_stage(cities, place, 'render', layers_hash=fetched['layers_hash'],
+                                  render_hash=_render_hash(backend))
+
+    return rendered is not None and os.path.exists(_render_output_path(place, backend))
+
+def _fetch_city_stage(place, get_features=True, slim=False, extent=None, mode=BATCH_FETCH_MODE):
+    """Gets city features, from the layers cache if they are there, and records the fetch stage in `manifest`
+
+        Returns the layers (see `get_many_city_data`) and a hash of their contents
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    get_features : bool
+        if download features missing in the cache, or fail
+    slim : bool
+        if keep layers compact, see `get_many_city_data`
+    extent : str
+        None for the whole place, or how to find its downtown, see `get_many_city_data`
+    mode : str
+        fetch mode, see `get_many_city_data`
+    """
+    key = _layers_cache_key(place, mode, slim=slim, extent=extent)
+    try:
+        if get_features:
+            layers = get_many_city_data(place, mode=mode, use_cache=True, slim=slim, extent=extent)
+        else:
+            layers = load_cached_city_data(place, mode=mode, slim=slim, extent=extent)
+    except Exception as error:
+        manifest.record_failure(place, 'fetch', error)
+        raise
+
+    layers_hash = layer_cache.layers_hash(key)
+    if manifest.get_stage(manifest.load_manifest(), place, 'fetch', key=key, layers_hash=layers_hash) is None:
+        manifest.record_stage(place, 'fetch', key=key, layers_hash=layers_hash)
+
+    return layers, layers_hash
+
+def _render_city_stage(place, layers, layers_hash, backend='matplotlib'):
+    """Plots the pictoral map of a city (see `_render_city`) and records the render stage in `manifest`
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    layers : tuple
+        city features, as returned by `get_many_city_data`
+    layers_hash : str
+        hash of contents of the layers, see `layer_cache.layers_hash`
+    backend : str
+        how to render the pictoral map, see `_render_city`
+    """
+    try:
+        _render_city(place, *layers, backend=backend)
+    except Exception as error:
+        manifest.record_failure(place, 'render', error)
+        raise
+
+    manifest.record_stage(place, 'render', layers_hash=layers_hash, render_hash=_render_hash(backend),
+                          backend=backend, output=_render_output_path(place, backend))
+
+def _main(cities=_get_list_of_cities(None), get_features=False, backend='matplotlib', profiler=None, force=False,
+          slim=False, extent=None, mode=BATCH_FETCH_MODE):
     """Run throught cities list
         get city features and plot city pictoral maps
 
+        Features are saved to the layers cache, so that with `get_features=False`
+        a city is re-plotted from the cache of a previous run.
+        See `_render_city` for `backend` options
+
+        Stages done are recorded in `manifest`, a rerun (f.e. after a crash) skips
+        cities whose maps are made of the same layers and style, re-plots from the cache
+        the ones whose style changed and downloads only new cities; `force=True` redoes all
+
+        With `slim=True` layers are kept compact, with `extent='center'` or 'density'
+        only downtowns are fetched and plotted; `mode` is how layers are queried,
+        by default tile by tile for big cities only, see `get_many_city_data`
+
+        Timings and memory of every stage are written to a run report
+        in `../reports`, see `profiling.stage`; with `profiler` ('cprofile' or
+        'pyinstrument') every stage is also profiled, see `profiling.start_run`
+
     """
+    profiling.start_run(profiler)
     for place in cities[:]:
         now = datetime.datetime.now()
+        if not force and _is_city_up_to_date(place, backend, slim, extent, mode):
+            print(f'{datetime.datetime.now()} location - {place}, up to date, skipped')
+            continue
 
         # get data features
-        if get_features:
-            area, edges, buildings, parkings, parks, waterways, water = get_many_city_data(place)
+        layers, layers_hash = _fetch_city_stage(place, get_features, slim, extent, mode)
 
         # plot data features
-        print(f'\t {datetime.datetime.now()} plotting interim cartograms')
-        visuals.plot_interim_maps(area, waterways, water, place, False)
-
-        print(f'\t {datetime.datetime.now()} plotting chart')
-        # Create a subplot object for plotting the layers onto a common map
-        fig, ax = plt.subplots(figsize=(16, 16), dpi=400) # dpi=600
-        visuals.plot_pictorial_map(area, edges, buildings, parkings, parks, waterways, water, ax)
-        fig.tight_layout()
-        print(f'\t {datetime.datetime.now()} saving chart')
-        # fig.savefig(f"Parks-Parkings {place}.svg", format = 'svg', dpi=1800)
-        fig.savefig(f"Parks-Parkings {place}.jpg", format = 'jpg', dpi=1800)
-        del(fig, area, edges, buildings, parkings, parks, waterways, water)
+        _render_city_stage(place, layers, layers_hash, backend=backend)
+        del layers
         print(f'\t {datetime.datetime.now() - now} executed')
+
+    print(f'{datetime.datetime.now()} run report - {", ".join(profiling.write_report())}')
+
+def _main_fetch(cities=_get_list_of_cities(None), slim=False, extent=None, mode=BATCH_FETCH_MODE):
+    """Run throught cities list
+        get city features into the layers cache, without rendering
+
+        Cities already in the cache are not loaded, failures are recorded
+        in `manifest` and reported, and the other cities go on
+
+        Returns dict of statuses of cities, 'fetched', 'cached' or 'failed'
+
+    Parameters
+    ----------
+    cities : list
+        list of places (locations) names in OSM format
+    slim : bool
+        if keep layers compact, see `get_many_city_data`
+    extent : str
+        None for whole places, or how to find their downtowns, see `get_many_city_data`
+    mode : str
+        fetch mode, see `get_many_city_data`
+    """
+    statuses = {}
+    for place in cities[:]:
+        if layer_cache.layers_hash(_layers_cache_key(place, mode, slim=slim, extent=extent)) is not None:
+            print(f'{datetime.datetime.now()} location - {place}, cached, skipped')
+            statuses[place] = 'cached'
+            continue
+        try:
+            layers, _ = _fetch_city_stage(place, get_features=True, slim=slim, extent=extent, mode=mode)
+            statuses[place] = 'fetched'
+            del layers
+        except Exception as error:
+            print(f'\t {datetime.datetime.now()} {place} failed - {type(error).__name__}: {error}')
+            statuses[place] = 'failed'
+
+    return statuses
+
+def _main_metrics(cities=_get_list_of_cities(None), get_features=False, slim=False, extent=None,
+                  cell_size=metrics.CELL_SIZE, save_path=metrics.METRICS_PATH, mode=BATCH_FETCH_MODE):
+    """Run throught cities list
+        get city features and measure parks, grass, parkings, buildings and water areas, without rendering
+
+        Returns tidy metrics of all cities (see `metrics.city_metrics`) and prints their ranking
+        by parks to parkings ratio; cities which fail are reported and skipped
+
+    Parameters
+    ----------
+    cities : list
+        list of places (locations) names in OSM format
+    get_features : bool
+        if download features missing in the layers cache, else use cached ones only
+    slim : bool
+        if keep layers compact, see `get_many_city_data`
+    extent : str
+        None for whole places, or how to find their downtowns, see `get_many_city_data`
+    cell_size : float
+        side of a grid cell in meters
+    save_path : str
+        path of the tidy table, see `metrics.export_metrics`
+    mode : str
+        fetch mode, see `get_many_city_data`
+    """
+    import pandas as pd
+
+    tables = []
+    for place in cities[:]:
+        try:
+            if get_features:
+                layers = get_many_city_data(place, mode=mode, use_cache=True, slim=slim, extent=extent)
+            else:
+                layers = load_cached_city_data(place, mode=mode, slim=slim, extent=extent)
+            print(f'\t {datetime.datetime.now()} measuring {place}')
+            with profiling.stage('metrics', place):
+                tables.append(metrics.city_metrics(*layers, place=place, cell_size=cell_size))
+            del layers
+        except Exception as error:
+            print(f'\t {datetime.datetime.now()} {place} failed - {type(error).__name__}: {error}')
+
+    table = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+    if tables:
+        metrics.export_metrics(table, save_path)
+        print(metrics.rank_cities(table).to_string())
+
+    return table
+
+def _main_vector_tiles(cities=_get_list_of_cities(None), get_features=False, slim=False, extent=None,
+                       min_zoom=vector_tiles.MIN_ZOOM, max_zoom=vector_tiles.MAX_ZOOM,
+                       tiles_folder=vector_tiles.TILES_FOLDER,
+                       save_path='../figures/internal/general_map_interactive.html', mode=BATCH_FETCH_MODE):
+    """Run throught cities list
+        get city features and export them as vector tiles, then plot the interactive map with them
+
+        Cities which fail are reported and left out of the map
+
+    Parameters
+    ----------
+    cities : list
+        list of places (locations) names in OSM format
+    get_features : bool
+        if download features missing in the layers cache, else use cached ones only
+    slim : bool
+        if keep layers compact, see `get_many_city_data`
+    extent : str
+        None for whole places, or how to find their downtowns, see `get_many_city_data`
+    min_zoom, max_zoom : int
+        zoom levels of tiles
+    tiles_folder : str
+        folder of tiles of all cities, see `vector_tiles.tiles_path`
+    save_path : str
+        path of the interactive map
+    mode : str
+        fetch mode, see `get_many_city_data`
+    """
+    locations, folders = {}, {}
+    for place in cities[:]:
+        try:
+            if get_features:
+                layers = get_many_city_data(place, mode=mode, use_cache=True, slim=slim, extent=extent)
+            else:
+                layers = load_cached_city_data(place, mode=mode, slim=slim, extent=extent)
+            print(f'\t {datetime.datetime.now()} cutting vector tiles of {place}')
+            path = vector_tiles.tiles_path(place, tiles_folder)
+            with profiling.stage('vector_tiles', place):
+                vector_tiles.export_vector_tiles(*layers, save_path=path, min_zoom=min_zoom, max_zoom=max_zoom,
+                                                 name=place)
+            center = layers[0].geometry.iloc[0].centroid
+            locations[place], folders[place] = [center.y, center.x], path
+            del layers
+        except Exception as error:
+            print(f'\t {datetime.datetime.now()} {place} failed - {type(error).__name__}: {error}')
+
+    return visuals.plot_general_map_interactive(locations, save_path, vector_tiles=folders)
+
+# Semaphores shared by worker processes of `_main_parallel`, set by `_init_worker`
+_DOWNLOAD_SEMAPHORE = None
+_RENDER_SEMAPHORE = None
+
+def _init_worker(download_semaphore, render_semaphore):
+    """Initializes a worker process of `_main_parallel`
+
+    Parameters
+    ----------
+    download_semaphore : multiprocessing.Semaphore
+        limits how many workers download data at once
+    render_semaphore : multiprocessing.Semaphore
+        limits how many workers render maps at once
+    """
+    global _DOWNLOAD_SEMAPHORE, _RENDER_SEMAPHORE
+    _DOWNLOAD_SEMAPHORE, _RENDER_SEMAPHORE = download_semaphore, render_semaphore
+
+    # workers have no display, render straight to files
+    import matplotlib
+    matplotlib.use('Agg')
+
+def _process_city(place, backend='matplotlib', profiler=None, run_id=None, force=False, slim=False, extent=None,
+                  mode=BATCH_FETCH_MODE):
+    """Gets city features and plots city pictoral map, in a worker process
+
+        Never raises: a failure is reported in the returned status,
+        so that one city does not abort the others. Cities which are
+        up to date in `manifest` are skipped, see `_main`
+
+        Returns dict with place, status, error, timings (in seconds) of the stages
+        and detailed stage records, see `profiling.stage`
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format to extract geometries from
+    backend : str
+        how to render the pictoral map, see `_render_city`
+    profiler : str
+        profiler of stages, see `profiling.start_run`
+    run_id : str
+        id of the run of the parent process
+    force : bool
+        if redo a city which is up to date
+    slim : bool
+        if keep layers compact, see `get_many_city_data`
+    extent : str
+        None for the whole place, or how to find its downtown, see `get_many_city_data`
+    mode : str
+        fetch mode, see `get_many_city_data`
+    """
+    import contextlib
+    import traceback
+
+    profiling.start_run(profiler, run_id)
+    result = {'place': place, 'status': 'ok', 'error': None,
+              'fetch_time': None, 'render_time': None, 'total_time': None, 'stages': []}
+    start = datetime.datetime.now()
+    try:
+        if not force and _is_city_up_to_date(place, backend, slim, extent, mode):
+            result['status'] = 'skipped'
+            result['total_time'] = (datetime.datetime.now() - start).total_seconds()
+            return result
+
+        with _DOWNLOAD_SEMAPHORE or contextlib.nullcontext():
+            stage_start = datetime.datetime.now()
+            layers, layers_hash = _fetch_city_stage(place, slim=slim, extent=extent, mode=mode)
+            result['fetch_time'] = (datetime.datetime.now() - stage_start).total_seconds()
+
+        with _RENDER_SEMAPHORE or contextlib.nullcontext():
+            stage_start = datetime.datetime.now()
+            _render_city_stage(place, layers, layers_hash, backend=backend)
+            result['render_time'] = (datetime.datetime.now() - stage_start).total_seconds()
+        del layers
+    except Exception as error:
+        result['status'] = 'failed'
+        result['error'] = f'{type(error).__name__}: {error}'
+        print(f'\t {datetime.datetime.now()} {place} failed\n{traceback.format_exc()}')
+    result['total_time'] = (datetime.datetime.now() - start).total_seconds()
+    result['stages'] = profiling.get_records()
+
+    return result
+
+def _print_run_table(results):
+    """Prints per-city timing and status table of a run
+
+    Parameters
+    ----------
+    results : list
+        list of dicts, as returned by `_process_city`
+    """
+    def _format_time(seconds):
+        return '-' if seconds is None else str(datetime.timedelta(seconds=round(seconds)))
+
+    width = max([len('city')] + [len(result['place']) for result in results])
+    print(f"{'city':<{width}}  {'status':<7}  {'fetch':>8}  {'render':>8}  {'total':>8}  error")
+    for result in results:
+        print(f"{result['place']:<{width}}  {result['status']:<7}  "
+              f"{_format_time(result['fetch_time']):>8}  {_format_time(result['render_time']):>8}  "
+              f"{_format_time(result['total_time']):>8}  {result['error'] or ''}")
+
+def _main_parallel(cities=_get_list_of_cities(None), n_workers=4, max_downloads=2, max_renders=1, backend='matplotlib',
+                   profiler=None, force=False, slim=False, extent=None, mode=BATCH_FETCH_MODE):
+    """Run throught cities list in a pool of processes
+        get city features and plot city pictoral maps
+
+        Downloads (network bound) and renders (CPU and memory bound)
+        are capped separately, so that f.e. four workers may wait on
+        Overpass while only one holds a 1800-dpi figure in memory
+
+        Returns list of per-city results, see `_process_city`
+
+    Parameters
+    ----------
+    cities : list
+        list of places (locations) names in OSM format
+    n_workers : int
+        number of worker processes
+    max_downloads : int
+        max number of cities downloading data at once
+    max_renders : int
+        max number of cities rendering maps at once
+    backend : str
+        how to render pictoral maps, see `_render_city`
+    profiler : str
+        profiler of stages, see `profiling.start_run`
+    force : bool
+        if redo cities which are up to date in `manifest`, see `_main`
+    slim : bool
+        if keep layers compact, see `get_many_city_data`
+    extent : str
+        None for whole places, or how to find their downtowns, see `get_many_city_data`
+    mode : str
+        fetch mode, see `get_many_city_data`
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    now = datetime.datetime.now()
+    run_id = profiling.start_run(profiler)
+    download_semaphore = multiprocessing.Semaphore(max_downloads)
+    render_semaphore = multiprocessing.Semaphore(max_renders)
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                             initargs=(download_semaphore, render_semaphore)) as executor:
+        futures = {executor.submit(_process_city, place, backend, profiler, run_id, force, slim, extent, mode): place for place in cities}
+        for future in as_completed(futures):
+            place = futures[future]
+            try:
+                results[place] = future.result()
+            except Exception as error: # f.e. a worker process was killed
+                results[place] = {'place': place, 'status': 'failed', 'error': f'{type(error).__name__}: {error}',
+                                  'fetch_time': None, 'render_time': None, 'total_time': None, 'stages': []}
+            profiling.add_records(results[place]['stages'])
+            print(f"{datetime.datetime.now()} {place} - {results[place]['status']}")
+
+    results = [results[place] for place in cities]
+    _print_run_table(results)
+    print(f'{datetime.datetime.now() - now} executed')
+    print(f'{datetime.datetime.now()} run report - {", ".join(profiling.write_report())}')
+
+    return results
@@ -0,0 +1,210 @@
+import datetime
+import functools
+import hashlib
+import json
+import os
+import shutil
+
+from . import __version__
+
+LAYER_NAMES = ['area', 'edges', 'buildings', 'parkings', 'parks', 'waterways', 'water']
+CACHE_FOLDER = '../data/interim/layers'
+DEFAULT_TTL = datetime.timedelta(days=30)
+DEFAULT_MAX_SIZE = 20 * 1024 ** 3 # bytes
+# modules whose code makes or stores the layers, a change to any of them makes cached layers stale
+LAYERS_CODE_MODULES = ['get_data.py', 'tiled_fetch.py', 'downtown.py', 'water_store.py', 'layer_cache.py']
+
+@functools.lru_cache(maxsize=None)
+def _code_hash():
+    """Returns a hash of the source of `LAYERS_CODE_MODULES`"""
+    digest = hashlib.sha1()
+    folder = os.path.dirname(os.path.abspath(__file__))
+    for name in LAYERS_CODE_MODULES:
+        with open(os.path.join(folder, name), 'rb') as file:
+            digest.update(file.read())
+
+    return digest.hexdigest()
+
+def cache_key(place, tags, bbox=None, **params):
+    """Returns a key of processed layers of a place
+
+        The key changes with the place, tag filters, bbox, any extra parameters
+        (f.e. fetch mode), the code version and the code which makes the layers (see `LAYERS_CODE_MODULES`),
+        so that stale layers are never loaded, even if a change to processing does not bump the version
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    tags : dict
+        tag filters the layers were queried with
+    bbox : list
+        bbox the layers were limited to, if any
+    **params
+        any other JSON-serializable parameters which change the layers
+    """
+    payload = json.dumps({'place': place, 'tags': tags, 'bbox': bbox, 'params': params,
+                          'version': __version__, 'code': _code_hash()}, sort_keys=True, default=str)
+
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def _prepare_for_parquet(gdf):
+    """Returns copy of a GeoDataFrame which Parquet can store
+
+        osmnx leaves lists (f.e. 'nodes', merged 'highway' of simplified edges)
+        and mixed types in tag columns, these values are stored as strings
+
+    Parameters
+    ----------
+    gdf : geopandas.geodataframe.GeoDataFrame
+        layer to store
+    """
+    gdf = gdf.copy()
+    for column in gdf.columns:
+        if column == gdf.geometry.name or gdf[column].dtype != object:
+            continue
+        gdf[column] = gdf[column].map(lambda value: value if value is None or isinstance(value, str)
+                                      or (isinstance(value, float) and value != value) else str(value))
+
+    return gdf
+
+def _entry_size(path):
+    """Returns size in bytes of a cache entry folder
+
+    Parameters
+    ----------
+    path : str
+        path to cache entry folder
+    """
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+def _files_hash(path):
+    """Returns a hash of contents of layer files of a cache entry folder
+
+    Parameters
+    ----------
+    path : str
+        path to cache entry folder
+    """
+    digest = hashlib.sha1()
+    for name in LAYER_NAMES:
+        with open(os.path.join(path, f'{name}.parquet'), 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 ** 2), b''):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+def save_layers(key, layers, place=None, cache_folder=CACHE_FOLDER, max_size=DEFAULT_MAX_SIZE):
+    """Saves processed layers of a place as GeoParquet files, then evicts old entries
+
+    Parameters
+    ----------
+    key : str
+        key of layers, see `cache_key`
+    layers : tuple
+        area, edges, buildings, parkings, parks, waterways, water GeoDataFrames
+    place : str
+        Place (location) name, stored for reference only
+    cache_folder : str
+        folder of the cache
+    max_size : int
+        max total size of the cache in bytes, least recently used entries are removed above it
+    """
+    entry_path = os.path.join(cache_folder, key)
+    temp_path = f'{entry_path}.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    for name, gdf in zip(LAYER_NAMES, layers):
+        _prepare_for_parquet(gdf).to_parquet(os.path.join(temp_path, f'{name}.parquet'))
+    with open(os.path.join(temp_path, 'meta.json'), 'w') as file:
+        json.dump({'place': place, 'created': datetime.datetime.now().isoformat(), 'version': __version__,
+                   'content_hash': _files_hash(temp_path)}, file)
+
+    # swap in a complete entry only, an interrupted run leaves no half-written one
+    shutil.rmtree(entry_path, ignore_errors=True)
+    os.rename(temp_path, entry_path)
+
+    evict(cache_folder, max_size)
+
+def load_layers(key, cache_folder=CACHE_FOLDER, ttl=DEFAULT_TTL):
+    """Loads processed layers of a place from the cache
+
+        Returns tuple of area, edges, buildings, parkings, parks, waterways, water
+        or None if there is no entry or it is older than `ttl`
+
+    Parameters
+    ----------
+    key : str
+        key of layers, see `cache_key`
+    cache_folder : str
+        folder of the cache
+    ttl : datetime.timedelta
+        max age of an entry, no limit if None
+    """
+    import geopandas as gpd
+
+    entry_path = os.path.join(cache_folder, key)
+    meta_path = os.path.join(entry_path, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path) as file:
+        meta = json.load(file)
+    if ttl is not None and datetime.datetime.now() - datetime.datetime.fromisoformat(meta['created']) > ttl:
+        shutil.rmtree(entry_path, ignore_errors=True)
+        return None
+
+    layers = tuple(gpd.read_parquet(os.path.join(entry_path, f'{name}.parquet')) for name in LAYER_NAMES)
+    os.utime(meta_path) # mark as recently used
+
+    return layers
+
+def layers_hash(key, cache_folder=CACHE_FOLDER):
+    """Returns a hash of contents of cached layers, or None if there is no entry
+
+        The hash changes whenever layers are downloaded again and differ,
+        see `manifest` for how it is used to skip unchanged work
+
+    Parameters
+    ----------
+    key : str
+        key of layers, see `cache_key`
+    cache_folder : str
+        folder of the cache
+    """
+    entry_path = os.path.join(cache_folder, key)
+    meta_path = os.path.join(entry_path, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+
+    with open(meta_path) as file:
+        meta = json.load(file)
+
+    return meta.get('content_hash') or _files_hash(entry_path)
+
+def evict(cache_folder=CACHE_FOLDER, max_size=DEFAULT_MAX_SIZE):
+    """Removes least recently used entries until the cache fits into `max_size`
+
+    Parameters
+    ----------
+    cache_folder : str
+        folder of the cache
+    max_size : int
+        max total size of the cache in bytes
+    """
+    if not os.path.isdir(cache_folder):
+        return
+
+    entries = []
+    for key in os.listdir(cache_folder):
+        meta_path = os.path.join(cache_folder, key, 'meta.json')
+        if os.path.exists(meta_path):
+            entries.append((os.path.getmtime(meta_path), key, _entry_size(os.path.join(cache_folder, key))))
+
+    total_size = sum(size for _, _, size in entries)
+    for _, key, size in sorted(entries):
+        if total_size <= max_size:
+            break
+        shutil.rmtree(os.path.join(cache_folder, key), ignore_errors=True)
+        total_size -= size
@@ -0,0 +1,64 @@
+import numpy as np
+
+TILE_SIZE = 256 # pixels, side of a web map tile
+MAX_ZOOM = 22
+
+def pixel_size(zoom):
+    """Returns size of a pixel in degrees at a zoom level of web maps, at the equator
+
+    Parameters
+    ----------
+    zoom : int
+        zoom level, the whole world is one tile at 0
+    """
+    return 360. / (TILE_SIZE * 2 ** zoom)
+
+def zoom_for_pixel_size(size):
+    """Returns the lowest zoom level with pixels no bigger than `size`, so that details it drops are sub-pixel
+
+    Parameters
+    ----------
+    size : float
+        size of a pixel in degrees
+    """
+    zoom = int(np.ceil(np.log2(360. / (TILE_SIZE * size))))
+
+    return min(max(zoom, 0), MAX_ZOOM)
+
+def zoom_for_view(bounds, width, height):
+    """Returns the zoom level of a view of `width` x `height` pixels showing `bounds`
+
+        The view keeps the same scale along both axes, as maps of cities do
+        (see `raster_render._map_transform`), the bigger of the two pixel sizes counts
+
+    Parameters
+    ----------
+    bounds : tuple
+        (minx, miny, maxx, maxy) in EPSG:4326
+    width, height : float
+        size of the view in pixels
+    """
+    minx, miny, maxx, maxy = bounds
+    coslat = np.cos(np.deg2rad((miny + maxy) / 2))
+
+    return zoom_for_pixel_size(max((maxx - minx) * coslat / width, (maxy - miny) / height))
+
+def simplify_for_zoom(geometries, zoom, units_per_degree=1.):
+    """Returns geometries simplified to a zoom level, geometries which collapse to nothing are dropped
+
+        Vertices closer than half a pixel of the zoom level to a simplified shape are removed;
+        topology is not preserved, which is much faster and fine for drawing
+
+    Parameters
+    ----------
+    geometries : geopandas.geoseries.GeoSeries
+        geometries in EPSG:4326, or in another CRS with `units_per_degree`
+    zoom : int
+        zoom level, see `zoom_for_view`
+    units_per_degree : float
+        units of the CRS per degree of longitude at the equator, f.e. meters of EPSG:3857
+    """
+    geometries = geometries[geometries.notna() & ~geometries.is_empty]
+    simplified = geometries.simplify(pixel_size(zoom) * units_per_degree / 2, preserve_topology=False)
+
+    return simplified[~simplified.is_empty]
@@ -0,0 +1,135 @@
+import datetime
+import hashlib
+import json
+import os
+
+MANIFEST_PATH = '../data/processed/manifest.jsonl'
+STAGES = ['fetch', 'render']
+
+def content_hash(*parts):
+    """Returns a hash of JSON-serializable parts, f.e. of style parameters of a map
+
+    Parameters
+    ----------
+    *parts
+        any JSON-serializable values, dicts are hashed regardless of key order
+    """
+    payload = json.dumps(parts, sort_keys=True, default=str)
+
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def load_manifest(path=MANIFEST_PATH):
+    """Returns the latest record of every stage of every city, {place: {stage: record}}
+
+        The manifest is a JSON Lines file, one record per finished (or failed) stage;
+        records are only appended, so that worker processes may write at once and
+        an interrupted run loses nothing but the stage it was in
+
+    Parameters
+    ----------
+    path : str
+        path to the manifest
+    """
+    cities = {}
+    if not os.path.exists(path):
+        return cities
+
+    with open(path) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError: # a line cut by a crash
+                continue
+            cities.setdefault(record['place'], {})[record['stage']] = record
+
+    return cities
+
+def _append_record(record, path):
+    """Appends a record to the manifest
+
+    Parameters
+    ----------
+    record : dict
+        record of a stage
+    path : str
+        path to the manifest
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    # one short write in append mode, so that lines of processes do not interleave
+    with open(path, 'a') as file:
+        file.write(json.dumps(record, sort_keys=True, default=str) + '\n')
+
+def record_stage(place, stage, path=MANIFEST_PATH, **hashes):
+    """Records that a stage of a city is done
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    stage : str
+        one of `STAGES`
+    path : str
+        path to the manifest
+    **hashes
+        content hashes of inputs of the stage (and any other details of it)
+    """
+    _append_record({'place': place, 'stage': stage, 'status': 'done',
+                    'time': datetime.datetime.now().isoformat(timespec='seconds'), **hashes}, path)
+
+def record_failure(place, stage, error, path=MANIFEST_PATH):
+    """Records that a stage of a city failed, so that the next run redoes it
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    stage : str
+        one of `STAGES`
+    error : Exception
+        error the stage failed with
+    path : str
+        path to the manifest
+    """
+    _append_record({'place': place, 'stage': stage, 'status': 'failed',
+                    'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                    'error': f'{type(error).__name__}: {error}'}, path)
+
+def get_stage(cities, place, stage, **hashes):
+    """Returns record of a stage of a city if it is done with the same input hashes, else None
+
+    Parameters
+    ----------
+    cities : dict
+        manifest, as returned by `load_manifest`
+    place : str
+        Place (location) name in OSM format
+    stage : str
+        one of `STAGES`
+    **hashes
+        content hashes of inputs of the stage now
+    """
+    record = cities.get(place, {}).get(stage)
+    if record is None or record['status'] != 'done':
+        return None
+    if any(record.get(name) != value for name, value in hashes.items()):
+        return None
+
+    return record
+
+def city_status(cities, place):
+    """Returns the last stage a city reached, 'failed: <stage>' or 'new'
+
+    Parameters
+    ----------
+    cities : dict
+        manifest, as returned by `load_manifest`
+    place : str
+        Place (location) name in OSM format
+    """
+    records = cities.get(place, {})
+    for stage in STAGES:
+        if records.get(stage, {}).get('status') == 'failed':
+            return f'failed: {stage}'
+    done = [stage for stage in STAGES if stage in records]
+
+    return done[-1] if done else 'new'
@@ -0,0 +1,253 @@
+import datetime
+import os
+
+import numpy as np
+
+from . import custom_visualizations as visuals
+
+# Layers measured, names as in `custom_visualizations.PICTORIAL_MAP_STYLE`
+METRIC_LAYERS = ['parks', 'grass', 'parkings', 'buildings', 'water']
+CELL_SIZE = 500 # meters
+METRICS_PATH = '../data/processed/metrics.csv'
+
+def _query_pairs(sindex, geometries, predicate):
+    """Returns (input, tree) index pairs of geometries and items of a spatial index which match a predicate
+
+    Parameters
+    ----------
+    sindex : geopandas.sindex.SpatialIndex
+        STRtree of geometries of one layer
+    geometries : geopandas.geoseries.GeoSeries
+        geometries to query the tree with
+    predicate : str
+        f.e. 'intersects' or 'contains'
+    """
+    import geopandas as gpd
+
+    if tuple(int(part) for part in gpd.__version__.split('.')[:2]) < (0, 12):
+        return sindex.query_bulk(geometries, predicate=predicate)
+
+    return sindex.query(geometries.values, predicate=predicate)
+
+def _polygons(geometries):
+    """Returns valid polygons out of geometries of a layer, multipolygons are exploded, anything else is dropped
+
+    Parameters
+    ----------
+    geometries : geopandas.geoseries.GeoSeries
+        geometries in a metric CRS
+    """
+    import geopandas as gpd
+
+    geometries = geometries[geometries.notna() & ~geometries.is_empty]
+    geometries = geometries[geometries.geom_type.isin(['Polygon', 'MultiPolygon'])]
+    is_invalid = ~geometries.is_valid
+    if is_invalid.any(): # f.e. self-touching rings of OSM multipolygons
+        geometries = geometries.copy()
+        geometries[is_invalid] = geometries[is_invalid].buffer(0)
+    geometries = geometries.explode(index_parts=False) if len(geometries) else geometries
+
+    return gpd.GeoSeries(geometries[geometries.geom_type == 'Polygon'].values, crs=geometries.crs)
+
+def _connected_components(count, left, right):
+    """Returns a label of each of `count` items, items linked by (left, right) pairs share a label
+
+    Parameters
+    ----------
+    count : int
+        number of items
+    left, right : numpy.ndarray
+        indices of linked items
+    """
+    labels = np.arange(count)
+    while True:
+        # each pair takes the smaller label of the two, until no label changes
+        smaller = np.minimum(labels[left], labels[right])
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, left, smaller)
+        np.minimum.at(new_labels, right, smaller)
+        new_labels = new_labels[new_labels] # pointer jumping
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+def _resolve_overlaps(polygons):
+    """Returns polygons of a layer with overlapping ones merged, so that no area is counted twice
+
+        Overlapping pairs are found with the STRtree of the layer and checked with one
+        vectorized intersection; only the groups of overlapping polygons are unioned
+
+    Parameters
+    ----------
+    polygons : geopandas.geoseries.GeoSeries
+        polygons in a metric CRS, see `_polygons`
+    """
+    import geopandas as gpd
+
+    if len(polygons) < 2:
+        return polygons
+
+    left, right = _query_pairs(polygons.sindex, polygons, 'intersects')
+    is_pair = left < right
+    left, right = left[is_pair], right[is_pair]
+    # polygons which touch along an edge do not overlap
+    overlap = gpd.GeoSeries(polygons.values[left]).intersection(gpd.GeoSeries(polygons.values[right]), align=False).area
+    left, right = left[overlap.values > 0], right[overlap.values > 0]
+    if len(left) == 0:
+        return polygons
+
+    labels = _connected_components(len(polygons), left, right)
+    is_merged = np.bincount(labels, minlength=len(polygons))[labels] > 1
+    merged = gpd.GeoDataFrame({'label': labels[is_merged]}, geometry=polygons.values[is_merged], crs=polygons.crs)
+    merged = merged.dissolve(by='label').geometry
+
+    return _polygons(gpd.GeoSeries(np.concatenate([polygons.values[~is_merged], merged.values]), crs=polygons.crs))
+
+def make_grid(area, cell_size=CELL_SIZE):
+    """Returns square grid cells covering a city, clipped to its shape
+
+        Returns GeoDataFrame with 'cell' ids ('{column}_{row}' from the south-west corner)
+        and 'cell_area' in square meters, in the CRS of `area`
+
+    Parameters
+    ----------
+    area : geopandas.geodataframe.GeoDataFrame
+        GeoDataFrame with shape of a place in a metric CRS
+    cell_size : float
+        side of a cell in meters
+    """
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    minx, miny, maxx, maxy = area.total_bounds
+    columns, rows = np.meshgrid(np.arange(int(np.ceil((maxx - minx) / cell_size))),
+                                np.arange(int(np.ceil((maxy - miny) / cell_size))))
+    columns, rows = columns.ravel(), rows.ravel()
+    cells = gpd.GeoSeries([box(minx + column * cell_size, miny + row * cell_size,
+                               minx + (column + 1) * cell_size, miny + (row + 1) * cell_size)
+                           for column, row in zip(columns, rows)], crs=area.crs)
+    cells = cells.intersection(area.geometry.iloc[0])
+
+    grid = gpd.GeoDataFrame({'cell': [f'{column}_{row}' for column, row in zip(columns, rows)],
+                             'cell_area': cells.area.values}, geometry=cells.values, crs=area.crs)
+
+    return grid[grid.cell_area > 0].reset_index(drop=True)
+
+def _areas_by_cell(polygons, grid):
+    """Returns area in square meters of polygons within each cell of a grid, array aligned with the grid
+
+        Candidate (cell, polygon) pairs come from the STRtree of the layer; polygons
+        which lie within a cell are counted whole, only the ones crossing borders
+        of cells are intersected, all in vectorized calls
+
+    Parameters
+    ----------
+    polygons : geopandas.geoseries.GeoSeries
+        polygons with no overlaps, see `_resolve_overlaps`
+    grid : geopandas.geodataframe.GeoDataFrame
+        cells, see `make_grid`
+    """
+    import geopandas as gpd
+
+    areas = np.zeros(len(grid))
+    if polygons.empty:
+        return areas
+
+    cell_index, polygon_index = _query_pairs(polygons.sindex, grid.geometry, 'intersects')
+    within_cell_index, within_polygon_index = _query_pairs(polygons.sindex, grid.geometry, 'contains')
+    # pairs as single integers, to find the ones where a cell contains a polygon
+    is_within = np.isin(cell_index * len(polygons) + polygon_index,
+                        within_cell_index * len(polygons) + within_polygon_index)
+
+    pair_areas = polygons.area.values[polygon_index]
+    crossing = ~is_within
+    pair_areas[crossing] = gpd.GeoSeries(grid.geometry.values[cell_index[crossing]]) \
+                              .intersection(gpd.GeoSeries(polygons.values[polygon_index[crossing]]), align=False).area.values
+    np.add.at(areas, cell_index, pair_areas)
+
+    return areas
+
+def city_metrics(area, edges, buildings, parkings, parks, waterways, water, place=None, cell_size=CELL_SIZE):
+    """Measures areas of parks, grass, parkings, buildings and water of a city, on a grid and in total
+
+        Layers are split as on the pictoral map (see `custom_visualizations._pictorial_map_layers`),
+        waterways polygons (f.e. lakes) are counted as water. All is projected to the UTM zone
+        of the city; overlapping footprints of one layer are merged, so that each square meter
+        counts once per layer, while layers may overlap each other (f.e. parking under a building)
+
+        Returns a tidy DataFrame with columns:
+            * place, level ('city' or 'cell'), cell, lon, lat (of a cell center)
+            * cell_area - land area of the city or cell within the city shape, m2
+            * layer, area (m2) and share (area / cell_area)
+
+    Parameters
+    ----------
+    area, edges, buildings, parkings, parks, waterways, water : geopandas.geodataframe.GeoDataFrame
+        city features, as returned by `get_data.get_many_city_data`
+    place : str
+        Place (location) name in OSM format
+    cell_size : float
+        side of a grid cell in meters
+    """
+    import pandas as pd
+    import geopandas as gpd
+
+    layers = visuals._pictorial_map_layers(area, edges, buildings, parkings, parks, waterways, water)
+    geometries = {layer: layers[layer].geometry.values for layer in METRIC_LAYERS}
+    geometries['water'] = np.concatenate([geometries['water'], layers['waterways'].geometry.values])
+
+    crs = area.estimate_utm_crs()
+    area = area.to_crs(crs)
+    grid = make_grid(area, cell_size)
+    centers = grid.geometry.centroid.to_crs('EPSG:4326')
+
+    rows = []
+    for layer in METRIC_LAYERS:
+        polygons = _resolve_overlaps(_polygons(gpd.GeoSeries(geometries[layer], crs='EPSG:4326').to_crs(crs)))
+        rows.append(pd.DataFrame({'place': place, 'level': 'cell', 'cell': grid.cell, 'lon': centers.x.values,
+                                  'lat': centers.y.values, 'cell_area': grid.cell_area, 'layer': layer,
+                                  'area': _areas_by_cell(polygons, grid)}))
+    table = pd.concat(rows, ignore_index=True)
+
+    # the cells cover the city shape with no overlaps, so the city total is their sum
+    center = area.geometry.centroid.to_crs('EPSG:4326').iloc[0]
+    totals = table.groupby('layer', sort=False)[['cell_area', 'area']].sum().reset_index()
+    totals = totals.assign(place=place, level='city', cell=None, lon=center.x, lat=center.y)
+    table = pd.concat([totals, table], ignore_index=True)
+    table['share'] = table['area'] / table['cell_area']
+
+    return table[['place', 'level', 'cell', 'lon', 'lat', 'cell_area', 'layer', 'area', 'share']]
+
+def rank_cities(table):
+    """Returns one row per city with area of each layer (m2) and the parks to parkings ratio, best first
+
+        Parks are parks and grass together
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        tidy metrics of one or many cities, see `city_metrics`
+    """
+    cities = table[table.level == 'city'].pivot_table(index='place', columns='layer', values='area', aggfunc='sum')
+    cities = cities.reindex(columns=METRIC_LAYERS, fill_value=0.)
+    cities['city_area'] = table[table.level == 'city'].groupby('place').cell_area.first()
+    cities['parks_to_parkings'] = (cities['parks'] + cities['grass']) / cities['parkings'].replace(0, np.nan)
+
+    return cities.sort_values('parks_to_parkings', ascending=False)
+
+def export_metrics(table, path=METRICS_PATH):
+    """Saves tidy metrics as CSV, or as Parquet if the path ends with .parquet
+
+    Parameters
+    ----------
+    table : pandas.DataFrame
+        tidy metrics, see `city_metrics`
+    path : str
+        path of a file
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if path.endswith('.parquet'):
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False)
+    print(f'\t {datetime.datetime.now()} metrics saved - {path}')
@@ -0,0 +1,237 @@
+import contextlib
+import contextvars
+import csv
+import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+REPORTS_FOLDER = '../reports'
+RECORD_FIELDS = ['run_id', 'place', 'stage', 'layer', 'status', 'start', 'wall_time', 'rss_start', 'rss_end',
+                 'rss_delta', 'peak_rss', 'peak_rss_increase', 'bytes_downloaded', 'features', 'memory_bytes', 'error']
+
+# State of the current run, see `start_run`
+_RUN = {'run_id': None, 'profiler': None, 'records': [], 'log_handler': None}
+_DOWNLOADS = {'lock': threading.Lock(), 'installed': False}
+# Byte counters of stages the running code is within, innermost last, see `stage`;
+# a new thread starts outside of any stage, unless it runs in a copy of the context of its parent
+_STAGE_DOWNLOADS = contextvars.ContextVar('stage_downloads', default=())
+
+def start_run(profiler=None, run_id=None, log=True):
+    """Starts a new run: clears collected stage records and sets up per-stage profiling
+
+        With `log=True` structured logs of stages (see `stage`) are written
+        as JSON lines into `run_{run_id}.log` next to reports of the run
+
+    Parameters
+    ----------
+    profiler : str
+        profile every stage with
+            * None - no profiling
+            * 'cprofile' - cProfile, `.prof` files for snakeviz or pstats
+            * 'pyinstrument' - pyinstrument, `.html` files
+    run_id : str
+        id of a run, current time by default; worker processes get the id of the parent run
+    log : bool
+        if write structured logs of stages
+    """
+    _RUN['run_id'] = run_id or datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    _RUN['profiler'] = profiler
+    _RUN['records'] = []
+    install_download_counter()
+
+    if _RUN['log_handler'] is not None: # logs of an earlier run
+        logger.removeHandler(_RUN['log_handler'])
+        _RUN['log_handler'].close()
+        _RUN['log_handler'] = None
+    if log:
+        os.makedirs(REPORTS_FOLDER, exist_ok=True)
+        # worker processes of a run append to the same file
+        handler = logging.FileHandler(os.path.join(REPORTS_FOLDER, f"run_{_RUN['run_id']}.log"))
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        _RUN['log_handler'] = handler
+
+    return _RUN['run_id']
+
+def get_records():
+    """Returns stage records of the current run"""
+    return list(_RUN['records'])
+
+def add_records(records):
+    """Adds stage records collected elsewhere (f.e. in worker processes) to the current run
+
+    Parameters
+    ----------
+    records : list
+        dicts, as made by `stage`
+    """
+    _RUN['records'].extend(records)
+
+def install_download_counter():
+    """Counts bytes of all HTTP responses got through `requests` (osmnx uses it for Overpass and Nominatim)
+        in the stages the request is made within, see `stage`
+
+        Responses from the osmnx cache are not downloaded and not counted
+    """
+    if _DOWNLOADS['installed']:
+        return
+    try:
+        import requests
+    except ImportError:
+        return
+
+    send = requests.Session.send
+    def _counting_send(session, request, **kwargs):
+        response = send(session, request, **kwargs)
+        counters = _STAGE_DOWNLOADS.get()
+        if counters:
+            size = len(response.content or b'')
+            with _DOWNLOADS['lock']:
+                for counter in counters:
+                    counter[0] += size
+        return response
+
+    requests.Session.send = _counting_send
+    _DOWNLOADS['installed'] = True
+
+def _rss():
+    """Returns current resident memory of the process, in bytes, None if it is unknown"""
+    try:
+        with open('/proc/self/statm') as file: # Linux
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+
+    return psutil.Process().memory_info().rss
+
+def _peak_rss():
+    """Returns peak resident memory of the process so far, in bytes"""
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024 # kilobytes on Linux
+
+@contextlib.contextmanager
+def _profile(record):
+    """Profiles a stage with the profiler of the current run, if any
+
+    Parameters
+    ----------
+    record : dict
+        record of a stage, see `stage`
+    """
+    profiler = None
+    folder = os.path.join(REPORTS_FOLDER, 'profiles', _RUN['run_id'] or 'no_run')
+    name = '-'.join(str(part) for part in [record['place'], record['stage'], record['layer']] if part)
+    try:
+        if _RUN['profiler'] == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif _RUN['profiler'] == 'pyinstrument':
+            import pyinstrument
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+    except ValueError: # only one profiler at a time, f.e. in concurrent fetch threads
+        profiler = None
+
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            os.makedirs(folder, exist_ok=True)
+            if _RUN['profiler'] == 'cprofile':
+                profiler.disable()
+                profiler.dump_stats(os.path.join(folder, f'{name}.prof'))
+            else:
+                profiler.stop()
+                with open(os.path.join(folder, f'{name}.html'), 'w') as file:
+                    file.write(profiler.output_html())
+
+@contextlib.contextmanager
+def stage(name, place=None, layer=None):
+    """Measures a stage of the pipeline and adds its record to the current run
+
+        Records wall time, resident memory (RSS) at the start and the end of the stage and their difference,
+        and bytes downloaded during the stage. `peak_rss` is the peak of the whole process so far,
+        `peak_rss_increase` is how much the stage raised it, so it is non-zero only for stages
+        which set a new peak, f.e. the memory bottleneck of a run.
+        The caller may add more fields to the yielded record, f.e. `record['features'] = len(gdf)`.
+        The record is logged as JSON at INFO level when the stage ends, see `start_run`.
+
+        Downloads are counted in the stages of the thread which makes them, so that stages running
+        at once in threads (f.e. layers of concurrent fetching) get their own bytes only; a stage
+        which starts threads of its own gets their bytes too, if they run in a copy of its context
+        (`contextvars.copy_context().run`, see `tiled_fetch.geometries_from_polygon_tiled`)
+
+    Parameters
+    ----------
+    name : str
+        name of a stage, f.e. 'geocode', 'fetch', 'filter', 'water', 'interim_plots', 'render', 'save'
+    place : str
+        Place (location) name in OSM format
+    layer : str
+        name of a layer, if a stage is about one
+    """
+    record = {'run_id': _RUN['run_id'], 'place': place, 'stage': name, 'layer': layer, 'status': 'ok',
+              'start': datetime.datetime.now().isoformat()}
+    logger.info(json.dumps({'event': 'stage_start', 'place': place, 'stage': name, 'layer': layer}))
+    record['rss_start'], start_peak_rss = _rss(), _peak_rss()
+    downloads = [0]
+    downloads_token = _STAGE_DOWNLOADS.set(_STAGE_DOWNLOADS.get() + (downloads,))
+    start_time = time.perf_counter()
+    try:
+        with _profile(record):
+            yield record
+    except Exception as error:
+        record['status'] = 'failed'
+        record['error'] = f'{type(error).__name__}: {error}'
+        raise
+    finally:
+        record['wall_time'] = time.perf_counter() - start_time
+        record['rss_end'], record['peak_rss'] = _rss(), _peak_rss()
+        if record['rss_start'] is not None and record['rss_end'] is not None:
+            record['rss_delta'] = record['rss_end'] - record['rss_start']
+        if start_peak_rss is not None:
+            record['peak_rss_increase'] = record['peak_rss'] - start_peak_rss
+        record['bytes_downloaded'] = downloads[0]
+        _STAGE_DOWNLOADS.reset(downloads_token)
+        _RUN['records'].append(record)
+        logger.info(json.dumps({'event': 'stage_end', **record}, default=str))
+
+def write_report(folder=REPORTS_FOLDER):
+    """Writes stage records of the current run to `run_{run_id}.json` and `run_{run_id}.csv`
+
+        Returns paths of both files
+
+    Parameters
+    ----------
+    folder : str
+        folder of reports
+    """
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"run_{_RUN['run_id']}")
+
+    with open(f'{path}.json', 'w') as file:
+        json.dump({'run_id': _RUN['run_id'], 'profiler': _RUN['profiler'],
+                   'records': _RUN['records']}, file, indent=1, default=str)
+    with open(f'{path}.csv', 'w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=RECORD_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(_RUN['records'])
+
+    return f'{path}.json', f'{path}.csv'
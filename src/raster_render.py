@@ -0,0 +1,271 @@
+import warnings
+
+import numpy as np
+
+from . import custom_visualizations as visuals
+
+def _to_rgb(color):
+    """Returns color as an array of floats in 0..255
+
+    Parameters
+    ----------
+    color : str
+        any matplotlib color, f.e. 'silver' or '#b5b536'
+    """
+    from matplotlib.colors import to_rgb
+
+    return np.array(to_rgb(color), dtype=np.float32) * 255
+
+def _map_transform(area, width, height, padding=0.02):
+    """Returns affine transform (shapely order) of lon/lat into pixels of a map
+
+        Same extent and aspect as `ox.plot_footprints` with a bbox of the area:
+        one pixel covers the same distance along both axes, the map is centered
+
+    Parameters
+    ----------
+    area : geopandas.geodataframe.GeoDataFrame
+        GeoDataFrame with shape of a place to get max and min .bounds from
+    width, height : int
+        size of an image in pixels
+    padding : float
+        share of an image left blank around the map
+    """
+    minx, miny, maxx, maxy = area.total_bounds
+    coslat = np.cos(np.deg2rad((miny + maxy) / 2))
+    scale = min(width * (1 - 2 * padding) / ((maxx - minx) * coslat),
+                height * (1 - 2 * padding) / (maxy - miny)) # pixels per degree of latitude
+    offset_x = (width - (maxx - minx) * coslat * scale) / 2
+    offset_y = (height - (maxy - miny) * scale) / 2
+
+    return [scale * coslat, 0, 0, -scale, offset_x - minx * scale * coslat, offset_y + maxy * scale]
+
+def _polygon_rings(geometries):
+    """Returns coordinates of rings of polygons and a polygon number of each ring
+
+    Parameters
+    ----------
+    geometries : iterable
+        shapely geometries, anything but polygons and multipolygons is skipped
+    """
+    rings, ring_ids = [], []
+    for polygon_id, geometry in enumerate(geometries):
+        for polygon in getattr(geometry, 'geoms', [geometry]):
+            if polygon.geom_type != 'Polygon':
+                continue
+            for ring in [polygon.exterior, *polygon.interiors]:
+                rings.append(np.asarray(ring.coords)[:, :2])
+                ring_ids.append(polygon_id)
+
+    return rings, ring_ids
+
+def _layer_edges(geometries, transform, linewidth_px):
+    """Returns edges of polygon rings of a layer in pixel coordinates
+
+        Lines are buffered to `linewidth_px` first. Edges are returned as
+        arrays x0, y0, x1, y1, polygon_id sorted by min y, horizontal ones are dropped
+
+    Parameters
+    ----------
+    geometries : geopandas.geoseries.GeoSeries
+        geometries of a layer in EPSG:4326
+    transform : list
+        affine transform, see `_map_transform`
+    linewidth_px : float
+        width of lines in pixels
+    """
+    geometries = geometries[~geometries.is_empty & geometries.notna()]
+    is_line = geometries.geom_type.isin(['LineString', 'MultiLineString', 'LinearRing'])
+
+    # polygons are transformed as one array of coordinates
+    rings, ring_ids = _polygon_rings(geometries[~is_line])
+    if rings:
+        a, b, d, e, offset_x, offset_y = transform
+        lengths = [len(ring) for ring in rings]
+        rings = np.split(np.concatenate(rings) @ np.array([[a, d], [b, e]]) + [offset_x, offset_y],
+                         np.cumsum(lengths)[:-1])
+
+    # lines are buffered in pixels, to keep their width the same along both axes
+    if is_line.any():
+        with warnings.catch_warnings(): # coordinates are pixels already, not degrees of the CRS
+            warnings.simplefilter('ignore', UserWarning)
+            lines = geometries[is_line].affine_transform(transform).buffer(max(linewidth_px, 1.) / 2, resolution=2)
+        line_rings, line_ids = _polygon_rings(lines)
+        rings += line_rings
+        ring_ids += [len(geometries) + line_id for line_id in line_ids]
+
+    if not rings:
+        return tuple(np.empty(0) for _ in range(5))
+
+    coordinates = np.concatenate(rings)
+    lengths = np.array([len(ring) for ring in rings])
+    # each ring is closed, an edge runs from every point but the last one of a ring
+    is_start = np.ones(len(coordinates), dtype=bool)
+    is_start[np.cumsum(lengths) - 1] = False
+    starts, ends = coordinates[:-1][is_start[:-1]], coordinates[1:][is_start[:-1]]
+    ids = np.repeat(ring_ids, lengths - 1)
+
+    x0, y0, x1, y1 = starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]
+    keep = y0 != y1
+    x0, y0, x1, y1, ids = x0[keep], y0[keep], x1[keep], y1[keep], ids[keep]
+    order = np.argsort(np.minimum(y0, y1), kind='stable')
+
+    return x0[order], y0[order], x1[order], y1[order], ids[order]
+
+def _rasterize_strip(edges, row_start, row_end, width):
+    """Returns boolean mask of pixels of rows [row_start, row_end) covered by polygons
+
+        A pixel is covered if its center is inside a polygon (even-odd rule)
+
+    Parameters
+    ----------
+    edges : tuple
+        edges of a layer, see `_layer_edges`
+    row_start, row_end : int
+        rows of a strip
+    width : int
+        width of an image in pixels
+    """
+    x0, y0, x1, y1, ids = edges
+    height = row_end - row_start
+    mask = np.zeros((height, width), dtype=bool)
+
+    # edges are sorted by min y, take the ones which may cross rows of the strip
+    y_min, y_max = np.minimum(y0, y1), np.maximum(y0, y1)
+    last = np.searchsorted(y_min, row_end - 0.5, side='right')
+    selected = np.flatnonzero(y_max[:last] > row_start + 0.5)
+    if selected.size == 0:
+        return mask
+    x0, y0, x1, y1, ids, y_min, y_max = (array[selected] for array in (x0, y0, x1, y1, ids, y_min, y_max))
+
+    # rows whose centers an edge crosses, half-open so that a vertex is counted once
+    first_row = np.maximum(np.ceil(y_min - 0.5), row_start).astype(np.int64)
+    end_row = np.minimum(np.ceil(y_max - 0.5), row_end).astype(np.int64)
+    counts = np.maximum(end_row - first_row, 0)
+    total = counts.sum()
+    if total == 0:
+        return mask
+
+    edge_index = np.repeat(np.arange(len(counts)), counts)
+    rows = first_row[edge_index] + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    xs = x0[edge_index] + (rows + 0.5 - y0[edge_index]) * \
+        (x1[edge_index] - x0[edge_index]) / (y1[edge_index] - y0[edge_index])
+    polygon_ids = ids[edge_index]
+
+    # pair crossings of one polygon and one row into spans
+    order = np.lexsort((xs, rows, polygon_ids))
+    xs, rows, polygon_ids = xs[order], rows[order], polygon_ids[order]
+    span_start, span_end = xs[0::2], xs[1::2]
+    span_row = rows[0::2]
+    valid = (span_row == rows[1::2]) & (polygon_ids[0::2] == polygon_ids[1::2])
+
+    first_col = np.clip(np.ceil(span_start - 0.5), 0, width).astype(np.int64)
+    end_col = np.clip(np.ceil(span_end - 0.5), 0, width).astype(np.int64)
+    valid &= first_col < end_col
+    offsets = (span_row[valid] - row_start) * (width + 1)
+
+    # spans as +1/-1 steps, a running sum along rows gives coverage
+    size = height * (width + 1)
+    steps = np.bincount(offsets + first_col[valid], minlength=size) - np.bincount(offsets + end_col[valid], minlength=size)
+    mask[:] = np.cumsum(steps.reshape(height, width + 1), axis=1)[:, :width] > 0
+
+    return mask
+
+def _prepare_layers(area, edges, buildings, parkings, parks, waterways, water, width, height, dpi):
+    """Returns layers of a pictoral map as (rgb, alpha, edges) in drawing order
+
+    Parameters
+    ----------
+    area, edges, buildings, parkings, parks, waterways, water : geopandas.geodataframe.GeoDataFrame
+        city features, see `custom_visualizations.plot_pictorial_map`
+    width, height : int
+        size of an image in pixels
+    dpi : float
+        pixels per inch, to convert line widths from points
+    """
+    transform = _map_transform(area, width, height)
+    layers = visuals._pictorial_map_layers(area, edges, buildings, parkings, parks, waterways, water)
+    # a stable sort keeps the order of the style for layers of one z-order, as matplotlib does
+    names = sorted(visuals.PICTORIAL_MAP_STYLE, key=lambda name: visuals.PICTORIAL_MAP_STYLE[name]['zorder'])
+
+    prepared = []
+    for name in names:
+        style = visuals.PICTORIAL_MAP_STYLE[name]
+        linewidth_px = style.get('linewidth', 1.) / 72 * dpi
+        layer_edges = _layer_edges(layers[name].geometry, transform, linewidth_px)
+        if len(layer_edges[0]):
+            prepared.append((_to_rgb(style['color']), style['alpha'], layer_edges))
+
+    return prepared
+
+def iter_pictorial_map_strips(area, edges, buildings, parkings, parks, waterways, water,
+                              figsize=16, dpi=1800, strip_height=512):
+    """Renders the pictoral map strip by strip
+
+        Yields (row_start, strip) where strip is uint8 array (rows, width, 3)
+
+    Parameters
+    ----------
+    area, edges, buildings, parkings, parks, waterways, water : geopandas.geodataframe.GeoDataFrame
+        city features, see `custom_visualizations.plot_pictorial_map`
+    figsize : float
+        size of a square image in inches
+    dpi : float
+        pixels per inch
+    strip_height : int
+        number of rows rendered at once
+    """
+    size = int(round(figsize * dpi))
+    layers = _prepare_layers(area, edges, buildings, parkings, parks, waterways, water, size, size, dpi)
+    background = _to_rgb(visuals.PICTORIAL_MAP_BACKGROUND)
+
+    for row_start in range(0, size, strip_height):
+        row_end = min(row_start + strip_height, size)
+        strip = np.empty((row_end - row_start, size, 3), dtype=np.float32)
+        strip[:] = background
+        for rgb, alpha, layer_edges in layers:
+            mask = _rasterize_strip(layer_edges, row_start, row_end, size)
+            if not mask.any():
+                continue
+            if alpha == 1:
+                strip[mask] = rgb
+            else:
+                strip[mask] += alpha * (rgb - strip[mask])
+        yield row_start, np.round(strip).astype(np.uint8)
+
+def render_pictorial_map(area, edges, buildings, parkings, parks, waterways, water,
+                         save_path=None, figsize=16, dpi=1800, strip_height=512):
+    """Renders the pictoral map into an RGB image, the fast alternative to `plot_pictorial_map`
+
+        Each layer is rasterized straight into a NumPy pixel buffer with a vectorized
+        scanline fill (even-odd rule, pixel centers) and composited with colors, alpha
+        and z-order of `custom_visualizations.PICTORIAL_MAP_STYLE`. No matplotlib artists
+        are created; rows are filled strip by strip, so that the fill of a layer
+        never holds more than a strip in memory
+
+        Returns uint8 array (height, width, 3)
+
+    Parameters
+    ----------
+    area, edges, buildings, parkings, parks, waterways, water : geopandas.geodataframe.GeoDataFrame
+        city features, see `custom_visualizations.plot_pictorial_map`
+    save_path : str
+        path where to save an image, format is taken from the extension (f.e. .jpg or .png)
+    figsize : float
+        size of a square image in inches
+    dpi : float
+        pixels per inch
+    strip_height : int
+        number of rows rendered at once
+    """
+    size = int(round(figsize * dpi))
+    image = np.empty((size, size, 3), dtype=np.uint8)
+    for row_start, strip in iter_pictorial_map_strips(area, edges, buildings, parkings, parks, waterways, water,
+                                                      figsize=figsize, dpi=dpi, strip_height=strip_height):
+        image[row_start:row_start + len(strip)] = strip
+
+    if save_path is not None:
+        from PIL import Image
+        Image.fromarray(image).save(save_path, quality=95, dpi=(dpi, dpi))
+
+    return image
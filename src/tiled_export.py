@@ -0,0 +1,135 @@
+import math
+import os
+
+import numpy as np
+
+from . import raster_render
+
+def _iter_tiles(strips, width, tile_size):
+    """Cuts strips of `tile_size` rows into tiles, row by row, edge tiles are padded to full size
+
+        Yields (row, col, tile) where tile is uint8 array (tile_size, tile_size, 3)
+
+    Parameters
+    ----------
+    strips : iterator
+        (row_start, strip) as yielded by `raster_render.iter_pictorial_map_strips`
+    width : int
+        width of an image in pixels
+    tile_size : int
+        size of a tile in pixels
+    """
+    for row_start, strip in strips:
+        for col_start in range(0, width, tile_size):
+            tile = np.zeros((tile_size, tile_size, 3), dtype=np.uint8)
+            part = strip[:, col_start:col_start + tile_size]
+            tile[:part.shape[0], :part.shape[1]] = part
+            yield row_start // tile_size, col_start // tile_size, tile
+
+def export_tiled_tiff(area, edges, buildings, parkings, parks, waterways, water, save_path,
+                      figsize=16, dpi=1800, tile_size=256, compression='zlib'):
+    """Renders the pictoral map straight into a tiled (Big)TIFF, strip by strip
+
+        Only one strip of `tile_size` rows is held in memory, whatever the resolution,
+        f.e. 16 inches at dpi=1800 take ~90 Mb (a float32 strip, see `raster_render.iter_pictorial_map_strips`)
+        instead of ~3.3 Gb of a full RGBA figure
+
+    Parameters
+    ----------
+    area, edges, buildings, parkings, parks, waterways, water : geopandas.geodataframe.GeoDataFrame
+        city features, see `custom_visualizations.plot_pictorial_map`
+    save_path : str
+        path where to save an image, f.e. 'Parks-Parkings Detroit.tif'
+    figsize : float
+        size of a square image in inches
+    dpi : float
+        pixels per inch
+    tile_size : int
+        size of a TIFF tile in pixels, multiple of 16
+    compression : str
+        TIFF compression, see `tifffile.TiffWriter.write`; 'zlib' is built in, others (f.e. 'jpeg') need imagecodecs
+    """
+    # !pip install tifffile
+    import tifffile
+
+    size = int(round(figsize * dpi))
+    strips = raster_render.iter_pictorial_map_strips(area, edges, buildings, parkings, parks, waterways, water,
+                                                     figsize=figsize, dpi=dpi, strip_height=tile_size)
+    tiles = (tile for _, _, tile in _iter_tiles(strips, size, tile_size))
+
+    with tifffile.TiffWriter(save_path, bigtiff=True) as tiff:
+        tiff.write(tiles, shape=(size, size, 3), dtype=np.uint8, tile=(tile_size, tile_size),
+                   photometric='rgb', compression=compression, resolution=(dpi, dpi, 'INCH'))
+
+def export_deepzoom(area, edges, buildings, parkings, parks, waterways, water, save_path,
+                    figsize=16, dpi=1800, tile_size=256, tile_format='jpg'):
+    """Renders the pictoral map into a DeepZoom tile pyramid for zoomable web viewers (f.e. OpenSeadragon)
+
+        The full-resolution level is written strip by strip, every lower level is
+        made tile by tile out of 4 tiles of the level above, read back from disk,
+        so that memory stays bounded whatever the resolution
+
+        Writes `{save_path}.dzi` descriptor and `{save_path}_files/{level}/{col}_{row}.{tile_format}` tiles
+
+    Parameters
+    ----------
+    area, edges, buildings, parkings, parks, waterways, water : geopandas.geodataframe.GeoDataFrame
+        city features, see `custom_visualizations.plot_pictorial_map`
+    save_path : str
+        path of a pyramid without extension, f.e. 'Parks-Parkings Detroit'
+    figsize : float
+        size of a square image in inches
+    dpi : float
+        pixels per inch
+    tile_size : int
+        size of a tile in pixels
+    tile_format : str
+        'jpg' or 'png'
+    """
+    from PIL import Image
+
+    size = int(round(figsize * dpi))
+    max_level = math.ceil(math.log2(size))
+    tiles_folder = f'{save_path}_files'
+
+    def _tile_path(level, col, row):
+        return os.path.join(tiles_folder, str(level), f'{col}_{row}.{tile_format}')
+
+    # full resolution level
+    os.makedirs(os.path.join(tiles_folder, str(max_level)), exist_ok=True)
+    strips = raster_render.iter_pictorial_map_strips(area, edges, buildings, parkings, parks, waterways, water,
+                                                     figsize=figsize, dpi=dpi, strip_height=tile_size)
+    for row, col, tile in _iter_tiles(strips, size, tile_size):
+        # DeepZoom edge tiles are not padded
+        height, width = min(tile_size, size - row * tile_size), min(tile_size, size - col * tile_size)
+        Image.fromarray(tile[:height, :width]).save(_tile_path(max_level, col, row), quality=90)
+
+    # lower levels, each one half the size of the level above
+    level_size = size
+    for level in range(max_level - 1, -1, -1):
+        level_size = math.ceil(level_size / 2)
+        os.makedirs(os.path.join(tiles_folder, str(level)), exist_ok=True)
+        num_tiles = math.ceil(level_size / tile_size)
+        for col in range(num_tiles):
+            for row in range(num_tiles):
+                canvas = Image.new('RGB', (2 * tile_size, 2 * tile_size))
+                width = height = 0
+                for d_col in range(2):
+                    for d_row in range(2):
+                        child_path = _tile_path(level + 1, 2 * col + d_col, 2 * row + d_row)
+                        if not os.path.exists(child_path):
+                            continue
+                        with Image.open(child_path) as child:
+                            canvas.paste(child, (d_col * tile_size, d_row * tile_size))
+                            width = max(width, d_col * tile_size + child.width)
+                            height = max(height, d_row * tile_size + child.height)
+                canvas = canvas.crop((0, 0, width, height))
+                canvas.resize((math.ceil(width / 2), math.ceil(height / 2)), Image.LANCZOS) \
+                      .save(_tile_path(level, col, row), quality=90)
+
+    with open(f'{save_path}.dzi', 'w') as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                   f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{tile_format}" '
+                   f'Overlap="0" TileSize="{tile_size}">\n'
+                   f'  <Size Width="{size}" Height="{size}"/>\n'
+                   '</Image>\n')
@@ -0,0 +1,174 @@
+import datetime
+
+MAX_FEATURES_PER_TILE = 50000
+MIN_TILE_SIZE = 0.01 # degrees, ~1 km
+
+def _overpass_filters(tags):
+    """Returns Overpass QL filters of features which have any of tags
+
+    Parameters
+    ----------
+    tags : dict
+        {tag: True} for any value, {tag: 'value'} or {tag: ['value', ...]} for selected values
+    """
+    filters = []
+    for tag, value in tags.items():
+        if value is True:
+            filters.append(f'["{tag}"]')
+        elif isinstance(value, str):
+            filters.append(f'["{tag}"="{value}"]')
+        else:
+            filters.append(f'["{tag}"~"^({"|".join(value)})$"]')
+
+    return filters
+
+def estimate_feature_count(bbox, tags):
+    """Returns number of OSM elements with any of tags in bbox, with a cheap count-only query
+
+    Parameters
+    ----------
+    bbox : tuple
+        (minx, miny, maxx, maxy) in EPSG:4326
+    tags : dict
+        tags in osmnx format, see `_overpass_filters`
+    """
+    import osmnx as ox
+
+    minx, miny, maxx, maxy = bbox
+    statements = ''.join(f'{element}{tag_filter}({miny},{minx},{maxy},{maxx});'
+                         for element in ['node', 'way', 'relation'] for tag_filter in _overpass_filters(tags))
+    query = f'[out:json][timeout:{ox.settings.timeout}];({statements});out count;'
+    response = ox.downloader.overpass_request(data={'data': query})
+
+    return int(response['elements'][0]['tags']['total'])
+
+def _polygonal_part(geometry):
+    """Returns polygons of a geometry as a Polygon or MultiPolygon, None if it has none
+
+        An intersection with a box may also give lines or points where shapes only touch,
+        which `ox.geometries_from_polygon` does not accept
+
+    Parameters
+    ----------
+    geometry : shapely.geometry.base.BaseGeometry
+        any shapely geometry
+    """
+    from shapely.geometry import MultiPolygon
+
+    if geometry.geom_type in ['Polygon', 'MultiPolygon']:
+        return None if geometry.is_empty else geometry
+    polygons = [part for part in getattr(geometry, 'geoms', [])
+                if part.geom_type == 'Polygon' and not part.is_empty]
+    polygons += [polygon for part in getattr(geometry, 'geoms', [])
+                 if part.geom_type == 'MultiPolygon' for polygon in part.geoms]
+    if not polygons:
+        return None
+
+    return polygons[0] if len(polygons) == 1 else MultiPolygon(polygons)
+
+def split_into_tiles(polygon, tags, max_features=MAX_FEATURES_PER_TILE, min_tile_size=MIN_TILE_SIZE):
+    """Splits a polygon into tiles with at most about `max_features` features each
+
+        The bbox of the polygon is cut in quarters until a count-only query
+        estimates that a tile is small enough; tiles are clipped to the polygon,
+        tiles without features or without area are dropped
+
+        Returns list of shapely polygons
+
+    Parameters
+    ----------
+    polygon : shapely.geometry.Polygon or MultiPolygon
+        shape of a place in EPSG:4326
+    tags : dict
+        tags in osmnx format, see `_overpass_filters`
+    max_features : int
+        max estimated number of features in a tile
+    min_tile_size : float
+        tiles are never cut smaller than this size in degrees
+    """
+    from shapely.geometry import box
+
+    tiles = []
+    queue = [polygon.bounds]
+    while queue:
+        minx, miny, maxx, maxy = queue.pop()
+        tile = _polygonal_part(polygon.intersection(box(minx, miny, maxx, maxy)))
+        if tile is None:
+            continue
+
+        count = estimate_feature_count(tile.bounds, tags)
+        if count == 0:
+            continue
+        if count <= max_features or max(maxx - minx, maxy - miny) / 2 < min_tile_size:
+            tiles.append(tile)
+            continue
+
+        midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+        queue.extend([(minx, miny, midx, midy), (midx, miny, maxx, midy),
+                      (minx, midy, midx, maxy), (midx, midy, maxx, maxy)])
+
+    return tiles
+
+def _fetch_tile(tile, tags):
+    """Downloads features of one tile, returns None if there are none
+
+    Parameters
+    ----------
+    tile : shapely.geometry.Polygon or MultiPolygon
+        shape of a tile in EPSG:4326
+    tags : dict
+        tags in osmnx format
+    """
+    import osmnx as ox
+    from osmnx._errors import EmptyOverpassResponse
+
+    try:
+        return ox.geometries_from_polygon(tile, tags)
+    except EmptyOverpassResponse:
+        return None
+
+def geometries_from_polygon_tiled(polygon, tags, max_features=MAX_FEATURES_PER_TILE, max_workers=4):
+    """Downloads features of a polygon tile by tile, same as `ox.geometries_from_polygon`
+
+        Tiles come from `split_into_tiles` and are fetched in a pool of threads.
+        Each tile is merged into the result as soon as it arrives, features
+        which cross borders of tiles are kept once, so that only one
+        layer and a few tiles are held in memory at once
+
+    Parameters
+    ----------
+    polygon : shapely.geometry.Polygon or MultiPolygon
+        shape of a place in EPSG:4326
+    tags : dict
+        tags in osmnx format
+    max_features : int
+        max estimated number of features in a tile
+    max_workers : int
+        number of threads
+    """
+    import contextvars
+
+    import pandas as pd
+    import geopandas as gpd
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    tiles = split_into_tiles(polygon, tags, max_features=max_features)
+    print(f'\t\t {datetime.datetime.now()} {len(tiles)} tiles')
+
+    parts, seen = [], set()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # downloads of tiles count in the stage which fetches the layer, see `profiling.stage`
+        futures = [executor.submit(contextvars.copy_context().run, _fetch_tile, tile, tags) for tile in tiles]
+        for future in as_completed(futures):
+            part = future.result()
+            if part is None:
+                continue
+            # the same way or relation comes with each tile it crosses
+            part = part[~part.index.isin(seen) & ~part.index.duplicated()]
+            seen.update(part.index)
+            parts.append(part)
+
+    if not parts:
+        return gpd.GeoDataFrame(geometry=[], crs='EPSG:4326')
+
+    return gpd.GeoDataFrame(pd.concat(parts), crs='EPSG:4326')
@@ -0,0 +1,330 @@
+import datetime
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import warnings
+
+import numpy as np
+
+from . import custom_visualizations as visuals
+from . import lod
+from . import metrics
+
+# Layers of tiles, names and style as in `custom_visualizations.PICTORIAL_MAP_STYLE`, the black area is left out;
+# polygons of layers drawn as lines go first, into layers of their own (see `custom_visualizations.AREAS_LAYER_SUFFIX`)
+VECTOR_TILE_LAYERS = [name for layer in ['grass', 'water', 'parks', 'waterways', 'roads', 'buildings', 'parkings', 'bridges']
+                      for name in ([layer + visuals.AREAS_LAYER_SUFFIX, layer]
+                                   if 'linewidth' in visuals.PICTORIAL_MAP_STYLE[layer] else [layer])]
+MIN_ZOOM = 10
+MAX_ZOOM = 16
+TILE_EXTENT = 4096 # units of a tile side
+TILE_BUFFER = 64 # units of a tile, features are cut this far outside of a tile so that lines join across tiles
+TILES_FOLDER = '../data/processed/tiles'
+MERCATOR_HALF_WORLD = 20037508.342789244 # meters of EPSG:3857
+BASE_GEOMETRY_TYPES = {'Polygon': 'Polygon', 'MultiPolygon': 'Polygon',
+                       'LineString': 'LineString', 'MultiLineString': 'LineString', 'LinearRing': 'LineString'}
+
+def tile_bounds(x, y, zoom):
+    """Returns (minx, miny, maxx, maxy) of a web map tile in EPSG:3857
+
+    Parameters
+    ----------
+    x, y : int
+        column and row of a tile, rows go from the north
+    zoom : int
+        zoom level
+    """
+    size = 2 * MERCATOR_HALF_WORLD / 2 ** zoom
+
+    return (-MERCATOR_HALF_WORLD + x * size, MERCATOR_HALF_WORLD - (y + 1) * size,
+            -MERCATOR_HALF_WORLD + (x + 1) * size, MERCATOR_HALF_WORLD - y * size)
+
+def _tile_range(bounds, zoom):
+    """Returns columns and rows of tiles at a zoom level which cover `bounds` in EPSG:3857
+
+    Parameters
+    ----------
+    bounds : tuple
+        (minx, miny, maxx, maxy) in EPSG:3857
+    zoom : int
+        zoom level
+    """
+    minx, miny, maxx, maxy = bounds
+    size = 2 * MERCATOR_HALF_WORLD / 2 ** zoom
+    last = 2 ** zoom - 1
+    columns = range(max(int((minx + MERCATOR_HALF_WORLD) // size), 0), min(int((maxx + MERCATOR_HALF_WORLD) // size), last) + 1)
+    rows = range(max(int((MERCATOR_HALF_WORLD - maxy) // size), 0), min(int((MERCATOR_HALF_WORLD - miny) // size), last) + 1)
+
+    return columns, rows
+
+def _encode_tile(features):
+    """Returns a Mapbox vector tile (protobuf bytes) of features of layers
+
+    Parameters
+    ----------
+    features : dict
+        shapely geometries of each layer in units of the tile, y going north, {layer: [geometry, ...]}
+    """
+    # !pip install mapbox-vector-tile
+    import mapbox_vector_tile
+    from mapbox_vector_tile.encoder import on_invalid_geometry_make_valid
+
+    layers = [{'name': layer, 'features': [{'geometry': geometry, 'properties': {}} for geometry in geometries]}
+              for layer, geometries in features.items()]
+    with warnings.catch_warnings(): # mapbox-vector-tile>=2 asks for its options as `default_options`
+        warnings.simplefilter('ignore', DeprecationWarning)
+        return mapbox_vector_tile.encode(layers, extents=TILE_EXTENT, on_invalid_geometry=on_invalid_geometry_make_valid)
+
+def _make_valid(geometries):
+    """Returns geometries with invalid polygons fixed, f.e. self-intersecting after `lod.simplify_for_zoom`
+        or as mapped in OSM, so that cutting them by tiles does not fail
+
+    Parameters
+    ----------
+    geometries : geopandas.geoseries.GeoSeries
+        geometries of a layer
+    """
+    invalid = ~geometries.is_valid & geometries.geom_type.isin(['Polygon', 'MultiPolygon'])
+    if not invalid.any():
+        return geometries
+
+    geometries = geometries.copy()
+    geometries[invalid] = geometries[invalid].buffer(0)
+
+    return geometries[~geometries.is_empty]
+
+def _parts_of_type(geometry, geom_type):
+    """Returns parts of a geometry of a type as one geometry, None if it has none
+
+        An intersection with a tile may give a GeometryCollection, f.e. a polygon with a line
+        where it touches the border of the tile, which vector tiles can not encode
+
+    Parameters
+    ----------
+    geometry : shapely.geometry.base.BaseGeometry
+        any shapely geometry
+    geom_type : str
+        'Polygon' or 'LineString'
+    """
+    from shapely.geometry import MultiLineString, MultiPolygon
+
+    parts = [part for item in getattr(geometry, 'geoms', [geometry]) for part in getattr(item, 'geoms', [item])
+             if part.geom_type == geom_type and not part.is_empty]
+    if not parts:
+        return None
+
+    return parts[0] if len(parts) == 1 else {'Polygon': MultiPolygon, 'LineString': MultiLineString}[geom_type](parts)
+
+def _cut_layer(geometries, tile_boxes):
+    """Returns features of a layer cut by tiles, as tile numbers and parts sorted by tile
+
+        Parts keep the geometry type of their feature, f.e. a polygon gives only polygons
+
+    Parameters
+    ----------
+    geometries : geopandas.geoseries.GeoSeries
+        geometries of a layer, valid ones (see `_make_valid`)
+    tile_boxes : geopandas.geoseries.GeoSeries
+        buffered boxes of tiles
+    """
+    import geopandas as gpd
+
+    tile_index, geometry_index = metrics._query_pairs(geometries.sindex, tile_boxes, 'intersects')
+    features = gpd.GeoSeries(geometries.values[geometry_index])
+    parts = features.intersection(gpd.GeoSeries(tile_boxes.values[tile_index]), align=False)
+
+    feature_types = features.geom_type.map(BASE_GEOMETRY_TYPES)
+    mixed = (parts.notna() & ~parts.is_empty & (parts.geom_type.map(BASE_GEOMETRY_TYPES) != feature_types)).values
+    if mixed.any():
+        parts = parts.copy()
+        parts[mixed] = gpd.GeoSeries([_parts_of_type(part, geom_type) for part, geom_type
+                                      in zip(parts[mixed], feature_types[mixed])], index=parts.index[mixed])
+    keep = (parts.notna() & ~parts.is_empty).values
+    order = np.argsort(tile_index[keep], kind='stable')
+
+    return tile_index[keep][order], gpd.GeoSeries(parts.values[keep][order])
+
+def iter_vector_tiles(area, edges, buildings, parkings, parks, waterways, water, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM):
+    """Cuts layers of a city into vector tiles, zoom level by zoom level
+
+        At each zoom level layers are simplified to half a pixel (see `lod.simplify_for_zoom`)
+        and made valid (see `_make_valid`), then all (tile, feature) pairs are found with the STRtree of a layer and cut
+        in one vectorized intersection; parts are moved into units of their tile
+        with one affine transform per tile and layer. Yields (zoom, x, y, tile) of tiles with any features
+
+    Parameters
+    ----------
+    area, edges, buildings, parkings, parks, waterways, water : geopandas.geodataframe.GeoDataFrame
+        city features, see `custom_visualizations.plot_pictorial_map`
+    min_zoom, max_zoom : int
+        zoom levels of tiles
+    """
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    layers = {}
+    for layer, gdf in visuals._pictorial_map_layers(area, edges, buildings, parkings, parks, waterways, water).items():
+        geometries = gdf.geometry.to_crs('EPSG:3857').reset_index(drop=True)
+        if layer + visuals.AREAS_LAYER_SUFFIX in VECTOR_TILE_LAYERS:
+            is_area = geometries.geom_type.isin(['Polygon', 'MultiPolygon']).values
+            layers[layer + visuals.AREAS_LAYER_SUFFIX] = geometries[is_area].reset_index(drop=True)
+            geometries = geometries[~is_area].reset_index(drop=True)
+        layers[layer] = geometries
+    layers = {layer: layers[layer] for layer in VECTOR_TILE_LAYERS}
+    city_bounds = area.to_crs('EPSG:3857').total_bounds
+
+    for zoom in range(min_zoom, max_zoom + 1):
+        columns, rows = _tile_range(city_bounds, zoom)
+        tiles = [(x, y) for y in rows for x in columns]
+        size = 2 * MERCATOR_HALF_WORLD / 2 ** zoom
+        tile_boxes = gpd.GeoSeries([box(*tile_bounds(x, y, zoom)).buffer(TILE_BUFFER / TILE_EXTENT * size, join_style=2)
+                                    for x, y in tiles], crs='EPSG:3857')
+
+        cut_layers = {}
+        for layer, geometries in layers.items():
+            geometries = _make_valid(lod.simplify_for_zoom(geometries, zoom, units_per_degree=MERCATOR_HALF_WORLD / 180))
+            if not geometries.empty:
+                cut_layers[layer] = _cut_layer(geometries, tile_boxes)
+
+        tiles_with_features = np.unique(np.concatenate([tile_index for tile_index, _ in cut_layers.values()] or [[]]))
+        scale = TILE_EXTENT / size
+        for tile in tiles_with_features.astype(int):
+            x, y = tiles[tile]
+            minx, miny, _, _ = tile_bounds(x, y, zoom)
+            features = {}
+            for layer, (tile_index, parts) in cut_layers.items():
+                start, end = np.searchsorted(tile_index, [tile, tile + 1])
+                if end > start:
+                    features[layer] = parts.iloc[start:end].affine_transform(
+                        [scale, 0, 0, scale, -minx * scale, -miny * scale]).values
+            yield zoom, x, y, _encode_tile(features)
+        print(f'\t\t {datetime.datetime.now()} zoom {zoom} - {len(tiles_with_features)} tiles')
+
+def _tiles_metadata(area, min_zoom, max_zoom, name):
+    """Returns metadata of a tile set, MBTiles 1.3 keys
+
+    Parameters
+    ----------
+    area : geopandas.geodataframe.GeoDataFrame
+        GeoDataFrame with shape of a place
+    min_zoom, max_zoom : int
+        zoom levels of tiles
+    name : str
+        name of the tile set
+    """
+    minx, miny, maxx, maxy = area.total_bounds
+
+    return {'name': name, 'format': 'pbf', 'type': 'overlay', 'minzoom': min_zoom, 'maxzoom': max_zoom,
+            'bounds': f'{minx},{miny},{maxx},{maxy}',
+            'center': f'{(minx + maxx) / 2},{(miny + maxy) / 2},{min_zoom}',
+            'json': json.dumps({'vector_layers': [{'id': layer, 'fields': {}, 'minzoom': min_zoom, 'maxzoom': max_zoom}
+                                                  for layer in VECTOR_TILE_LAYERS]})}
+
+def _write_mbtiles(tiles, metadata, save_path):
+    """Writes vector tiles into a MBTiles (SQLite) file, gzipped as the format expects
+
+    Parameters
+    ----------
+    tiles : iterator
+        (zoom, x, y, tile) as yielded by `iter_vector_tiles`
+    metadata : dict
+        metadata of the tile set, see `_tiles_metadata`
+    save_path : str
+        path of the file
+    """
+    temp_path = f'{save_path}.tmp'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    count = 0
+    connection = sqlite3.connect(temp_path)
+    try:
+        connection.execute('CREATE TABLE metadata (name TEXT, value TEXT)')
+        connection.execute('CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB)')
+        connection.executemany('INSERT INTO metadata VALUES (?, ?)', [(key, str(value)) for key, value in metadata.items()])
+        for zoom, x, y, tile in tiles:
+            # rows of MBTiles go from the south (TMS)
+            connection.execute('INSERT INTO tiles VALUES (?, ?, ?, ?)', (zoom, x, 2 ** zoom - 1 - y, gzip.compress(tile)))
+            count += 1
+        connection.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(temp_path, save_path)
+
+    return count
+
+def _write_tile_folder(tiles, metadata, save_path):
+    """Writes vector tiles as `{z}/{x}/{y}.pbf` files and `metadata.json`, which any static web server can serve
+
+    Parameters
+    ----------
+    tiles : iterator
+        (zoom, x, y, tile) as yielded by `iter_vector_tiles`
+    metadata : dict
+        metadata of the tile set, see `_tiles_metadata`
+    save_path : str
+        path of the folder
+    """
+    temp_path = f'{save_path}.tmp'
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    count = 0
+    for zoom, x, y, tile in tiles:
+        os.makedirs(os.path.join(temp_path, str(zoom), str(x)), exist_ok=True)
+        with open(os.path.join(temp_path, str(zoom), str(x), f'{y}.pbf'), 'wb') as file:
+            file.write(tile)
+        count += 1
+    with open(os.path.join(temp_path, 'metadata.json'), 'w') as file:
+        json.dump(metadata, file)
+
+    # swap in complete tiles only, no stale tiles of an earlier export are left
+    shutil.rmtree(save_path, ignore_errors=True)
+    os.rename(temp_path, save_path)
+
+    return count
+
+def export_vector_tiles(area, edges, buildings, parkings, parks, waterways, water, save_path,
+                        min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM, name=None):
+    """Exports layers of a city as vector tiles, which a web map streams tile by tile, see `iter_vector_tiles`
+
+        Tiles are written into a MBTiles file if `save_path` ends with .mbtiles (f.e. for a tile server),
+        else into a folder of tiles (see `_write_tile_folder`), which
+        `custom_visualizations.plot_general_map_interactive` shows as an overlay
+
+    Parameters
+    ----------
+    area, edges, buildings, parkings, parks, waterways, water : geopandas.geodataframe.GeoDataFrame
+        city features, see `custom_visualizations.plot_pictorial_map`
+    save_path : str
+        path of a .mbtiles file or of a folder
+    min_zoom, max_zoom : int
+        zoom levels of tiles, at 16 a pixel is ~2.4 m at the equator
+    name : str
+        name of the tile set, f.e. the place
+    """
+    metadata = _tiles_metadata(area, min_zoom, max_zoom, name or os.path.basename(save_path))
+    tiles = iter_vector_tiles(area, edges, buildings, parkings, parks, waterways, water, min_zoom, max_zoom)
+    os.makedirs(os.path.dirname(save_path) or '.', exist_ok=True)
+    if save_path.endswith('.mbtiles'):
+        count = _write_mbtiles(tiles, metadata, save_path)
+    else:
+        count = _write_tile_folder(tiles, metadata, save_path)
+    print(f'\t {datetime.datetime.now()} {count} vector tiles saved - {save_path}')
+
+    return count
+
+def tiles_path(place, folder=TILES_FOLDER):
+    """Returns path of the folder of vector tiles of a place
+
+    Parameters
+    ----------
+    place : str
+        Place (location) name in OSM format
+    folder : str
+        folder of all tile sets
+    """
+    return os.path.join(folder, place)
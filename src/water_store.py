@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+
+STORE_FOLDER = '../data/interim/water_polygons'
+TILE_SIZE = 1. # degrees
+META_FILE = '_water_store.json'
+
+def _tile_path(store_folder, ix, iy):
+    """Returns path to a folder of one tile of a store"""
+    return os.path.join(store_folder, f'{ix}_{iy}')
+
+def build_water_store(source_path, store_folder=STORE_FOLDER, tile_size=TILE_SIZE, chunk_size=100000):
+    """Converts water polygons into a tiled GeoParquet store, one-time preprocessing step
+
+        Water polygons (https://osmdata.openstreetmap.de/data/water-polygons.html) are read
+        in chunks, reprojected to EPSG:4326 and cut by a grid of `tile_size` degrees.
+        Each tile is a folder of GeoParquet parts, so that a lookup reads only the tiles
+        which cover a city. Polygons of the source are already split into small pieces,
+        most of them fall into one tile and are stored as is. The store is built aside
+        and replaces an earlier one only when complete, no parts of it are left behind
+
+    Parameters
+    ----------
+    source_path : str
+        path to water polygons shapefile; tested for raw, about ~700Mb, file
+    store_folder : str
+        folder of the store
+    tile_size : float
+        size of a tile in degrees
+    chunk_size : int
+        number of polygons read from the source at once
+    """
+    import pandas as pd
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    store_folder = os.path.normpath(store_folder)
+    temp_folder = f'{store_folder}.tmp'
+    shutil.rmtree(temp_folder, ignore_errors=True)
+    os.makedirs(temp_folder)
+
+    chunk_num = 0
+    while True:
+        chunk = gpd.read_file(source_path, rows=slice(chunk_num * chunk_size, (chunk_num + 1) * chunk_size))
+        if chunk.empty:
+            break
+        if chunk.crs.to_epsg() != 4326:
+            chunk = chunk.to_crs(epsg=4326)
+        chunk = chunk[['geometry']]
+
+        bounds = chunk.bounds
+        ix_min, ix_max = (bounds.minx.values // tile_size).astype(int), (bounds.maxx.values // tile_size).astype(int)
+        iy_min, iy_max = (bounds.miny.values // tile_size).astype(int), (bounds.maxy.values // tile_size).astype(int)
+        single_tile = (ix_min == ix_max) & (iy_min == iy_max)
+
+        parts = [chunk[single_tile].assign(ix=ix_min[single_tile], iy=iy_min[single_tile])]
+        # cut polygons which cross borders of tiles
+        pieces = []
+        for geometry, x_range, y_range in zip(chunk.geometry[~single_tile],
+                                              zip(ix_min[~single_tile], ix_max[~single_tile]),
+                                              zip(iy_min[~single_tile], iy_max[~single_tile])):
+            for ix in range(x_range[0], x_range[1] + 1):
+                for iy in range(y_range[0], y_range[1] + 1):
+                    piece = geometry.intersection(box(ix * tile_size, iy * tile_size,
+                                                      (ix + 1) * tile_size, (iy + 1) * tile_size))
+                    if piece.area > 0: # not just a touching border
+                        pieces.append((piece, ix, iy))
+        if pieces:
+            geometries, ixs, iys = zip(*pieces)
+            parts.append(gpd.GeoDataFrame({'ix': ixs, 'iy': iys}, geometry=list(geometries), crs='EPSG:4326'))
+
+        for (ix, iy), tile in pd.concat(parts).groupby(['ix', 'iy']):
+            os.makedirs(_tile_path(temp_folder, ix, iy), exist_ok=True)
+            tile[['geometry']].reset_index(drop=True).to_parquet(
+                os.path.join(_tile_path(temp_folder, ix, iy), f'part-{chunk_num}.parquet'))
+        print(f'\t chunk {chunk_num}: {len(chunk)} polygons')
+        chunk_num += 1
+
+    with open(os.path.join(temp_folder, META_FILE), 'w') as file:
+        json.dump({'source': os.path.abspath(source_path), 'tile_size': tile_size, 'crs': 'EPSG:4326'}, file)
+
+    shutil.rmtree(store_folder, ignore_errors=True)
+    os.rename(temp_folder, store_folder)
+
+def is_water_store(path):
+    """Returns True if path is a folder of a store made by `build_water_store`
+
+    Parameters
+    ----------
+    path : str
+        path to check
+    """
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+def find_water_store(source_path, store_folder=STORE_FOLDER):
+    """Returns path to a store built from `source_path`, or None if there is no such store
+
+    Parameters
+    ----------
+    source_path : str
+        path to water polygons file, or to a store itself
+    store_folder : str
+        folder of the default store
+    """
+    if is_water_store(source_path):
+        return source_path
+    if is_water_store(store_folder):
+        with open(os.path.join(store_folder, META_FILE)) as file:
+            if json.load(file)['source'] == os.path.abspath(source_path):
+                return store_folder
+
+    return None
+
+def load_water(bounds, store_folder=STORE_FOLDER):
+    """Returns water polygons within bounds, clipped to them
+
+        Only parts of tiles which cover bounds are read, through memory-mapped I/O
+
+    Parameters
+    ----------
+    bounds : tuple
+        (minx, miny, maxx, maxy) in EPSG:4326
+    store_folder : str
+        folder of the store
+    """
+    import pandas as pd
+    import geopandas as gpd
+    from shapely.geometry import box
+
+    with open(os.path.join(store_folder, META_FILE)) as file:
+        tile_size = json.load(file)['tile_size']
+
+    minx, miny, maxx, maxy = bounds
+    parts = []
+    for ix in range(int(minx // tile_size), int(maxx // tile_size) + 1):
+        for iy in range(int(miny // tile_size), int(maxy // tile_size) + 1):
+            tile_path = _tile_path(store_folder, ix, iy)
+            if not os.path.isdir(tile_path):
+                continue # no water in a tile
+            parts.extend(gpd.read_parquet(os.path.join(tile_path, name), memory_map=True)
+                         for name in sorted(os.listdir(tile_path)))
+
+    if not parts:
+        return gpd.GeoDataFrame(geometry=[], crs='EPSG:4326')
+    water = gpd.GeoDataFrame(pd.concat(parts, ignore_index=True), crs='EPSG:4326')
+
+    return gpd.clip(water, box(*bounds))